@@ -1,16 +1,318 @@
+import codecs
+import errno
+import os
+import queue
+import random
 import socket
+import string
+import selectors
+import sys
+import tempfile
 import threading
+import time
+import heapq
+from array import array
+from bisect import bisect_left
+from collections import deque
+from itertools import chain, islice
+from time import perf_counter_ns
+from concurrent.futures import ThreadPoolExecutor
 import tkinter as tk
-from tkinter import ttk, scrolledtext
+from tkinter import ttk, scrolledtext, font as tkfont
 from datetime import datetime
 from colorama import Fore, Style
 
-class ChannelWindow:
+class Channel:
+    """Headless state of a joined channel; its ChannelWindow is only built when the user opens it"""
+    USERS_REFRESH_DELAY = 50  # ms over which member changes are collected into one list refresh
+
     def __init__(self, irc_client, channel_name, server):
         self.irc_client = irc_client
         self.channel_name = channel_name
         self.server = server
-        self.users = set()
+        # Interned nick -> status mode bits (ISupport.prefix_bits); the
+        # prefix shown in the list is derived from the bits when drawing
+        self.members = {}
+        # (rank, folded nick, nick) of every member in list order, so the
+        # list row of a member is found by bisection
+        self.sorted_keys = []
+        # Row edits waiting for the next refresh of an open window, in order;
+        # the nick list draws from sorted_keys and only needs them to follow its selection
+        self.pending_rows = []
+        self.redraw_users = False     # Whole list replaced, drop the selection
+        self.refresh_scheduled = False
+        self.users_refreshes = 0      # Refreshes that actually touched the widget
+        self.coalesced_updates = 0    # Changes folded into an already scheduled refresh
+        self.batch_updating = False
+        self.names_buffer = {}  # Members collected from 353 replies until 366
+        self.prefix_order = self.isupport.prefix_order  # PREFIX mode order the member bits follow
+        self.topic = ''
+        self.modes = {}  # Channel mode -> argument or None, without list and status modes
+        # Segments of the latest lines, replayed into the window when it is built
+        self.recent = deque(maxlen=irc_client.preferences['channel_backlog'])
+        self.view = None  # ChannelWindow, once opened from the network tree
+        self.is_closing = False
+
+    @property
+    def isupport(self):
+        """Protocol details of this channel's server"""
+        conn = self.irc_client.connections.get(self.server)
+        return conn.isupport if conn is not None else self.irc_client.default_isupport
+
+    def open(self):
+        """Build the window on first use and fill it from the channel state"""
+        if self.view is None:
+            self.view = ChannelWindow(self)
+            self.view.render(*chain.from_iterable(self.recent))
+            self.pending_rows.clear()
+            self.redraw_users = True
+            self.schedule_users_refresh()
+        return self.view
+
+    def toggle_visibility(self):
+        if self.view is None:
+            self.open().window.lift()
+        else:
+            self.view.toggle_visibility()
+
+    def close_view(self):
+        """Destroy the window, if one was built; the channel state stays"""
+        view, self.view = self.view, None
+        if view is not None:
+            view.destroy()
+
+    def part(self):
+        """Leave the channel and forget it"""
+        try:
+            self.is_closing = True
+            # Remove channel from network tree
+            self.irc_client.remove_channel_node(self.channel_name, self.server)
+
+            # Clean up channels dict
+            self.irc_client.channels.pop(
+                self.irc_client.window_key(self.server, self.channel_name), None
+            )
+            self.irc_client.send_command(f"PART {self.channel_name}", self.server)
+            self.close_view()
+        except Exception as e:
+            print(f"Error parting {self.channel_name}: {e}")
+
+    def remove_user(self, user):
+        """Remove a user from the channel and update the UI"""
+        try:
+            # Accept the nick with or without its shown prefix
+            nick = self.isupport.strip_prefix(user)
+            modes = self.members.pop(nick, None)
+            if modes is not None:
+                self._unlist_member(nick, modes)
+            
+            print(f"DEBUG - Removed user {user} from {self.channel_name}")
+            
+        except Exception as e:
+            print(f"Error removing user: {e}")
+            self.irc_client.add_status_message(f"Error removing user: {e}")
+
+
+    def add_member(self, nick, modes=0):
+        """Add a member (or change its modes) and show it at its sorted row"""
+        nick = sys.intern(nick)
+        old_modes = self.members.get(nick)
+        if old_modes == modes:
+            return
+        if old_modes is not None:
+            self._unlist_member(nick, old_modes)
+        self.members[nick] = modes
+        self._list_member(nick, modes)
+
+    def rename_user(self, old, new):
+        """Rename a member, keeping their status modes"""
+        modes = self.members.pop(old, None)
+        if modes is not None:
+            self._unlist_member(old, modes)
+            self.add_member(new, modes)
+
+    def member_key(self, nick, modes):
+        isupport = self.isupport
+        return (isupport.rank(modes), isupport.fold(nick), nick)
+
+    def _list_member(self, nick, modes):
+        """Insert a member's row at its sorted position"""
+        key = self.member_key(nick, modes)
+        index = bisect_left(self.sorted_keys, key)
+        self.sorted_keys.insert(index, key)
+        if self.view is not None:
+            self.pending_rows.append((index, self.isupport.prefix_of(modes) + nick))
+            self.schedule_users_refresh()
+
+    def _unlist_member(self, nick, modes):
+        """Delete a member's row, found by bisection"""
+        key = self.member_key(nick, modes)
+        index = bisect_left(self.sorted_keys, key)
+        if index < len(self.sorted_keys) and self.sorted_keys[index] == key:
+            del self.sorted_keys[index]
+            if self.view is not None:
+                self.pending_rows.append((index, None))
+                self.schedule_users_refresh()
+
+    def apply_prefix_changes(self, changes):
+        """Apply (adding, mode bit, nick) changes to the members, moving only their rows"""
+        members = self.members
+        for adding, bit, nick in changes:
+            modes = members.get(nick)
+            if modes is not None:
+                self.add_member(nick, modes | bit if adding else modes & ~bit)
+
+    def apply_mode_changes(self, changes):
+        """Track (adding, mode, arg) channel mode changes, skipping list modes like bans"""
+        list_modes = self.isupport.chanmodes[0]
+        for adding, mode, arg in changes:
+            if mode in list_modes:
+                continue
+            if adding:
+                self.modes[mode] = arg
+            else:
+                self.modes.pop(mode, None)
+
+    def sorted_users(self):
+        """Members as shown in the list: highest status first, then by name"""
+        prefix_of = self.isupport.prefix_of
+        members = self.members
+        return [prefix_of(members[nick]) + nick for _, _, nick in self.sorted_keys]
+
+    def user_row(self, index):
+        """Text and mode bits of one nick list row"""
+        nick = self.sorted_keys[index][2]
+        modes = self.members[nick]
+        return self.isupport.prefix_of(modes) + nick, modes
+
+    def begin_batch_update(self):
+        """Start a batch update of the users list"""
+        self.batch_updating = True
+        self.names_buffer.clear()
+
+
+    def add_action(self, sender, action_text):
+        timestamp = datetime.now().strftime("[%H:%M:%S]")
+        self.render(f"{timestamp} ", 'timestamp', f"* {sender} {action_text}\n", 'action')
+
+    def schedule_users_refresh(self):
+        """Refresh the users list once per frame, however many members changed"""
+        if self.refresh_scheduled:
+            self.coalesced_updates += 1
+            return
+        if self.view is not None and not self.is_closing:
+            try:
+                # On the status window, which outlives this channel's window
+                self.irc_client.status_window.after(self.USERS_REFRESH_DELAY, self._update_users_list_safe)
+                self.refresh_scheduled = True
+            except Exception as e:
+                print(f"Error updating users list: {e}")
+
+    def _update_users_list_safe(self):
+        """Internal method to safely update users list in the GUI thread"""
+        self.refresh_scheduled = False
+        rows, self.pending_rows = self.pending_rows, []
+        redraw, self.redraw_users = self.redraw_users, False
+        if self.view is None:
+            return  # Closed while the refresh was pending
+        try:
+            self.view.refresh_users(rows, redraw)
+            self.users_refreshes += 1
+        except Exception as e:
+            print(f"Error in _update_users_list_safe: {e}")
+            
+    def rebuild_members(self):
+        """Re-encode member bits for the server's current PREFIX, then re-sort"""
+        isupport = self.isupport
+        order = self.prefix_order
+        if isupport.prefix_order != order:
+            self.members = {nick: isupport.remap(modes, order) for nick, modes in self.members.items()}
+            self.names_buffer = {nick: isupport.remap(modes, order) for nick, modes in self.names_buffer.items()}
+            self.prefix_order = isupport.prefix_order
+        self.update_users_list()
+
+    def update_users_list(self):
+        """Re-sort every member and redraw the whole list on the next refresh"""
+        # For when the whole member table was replaced; single changes go
+        # through add_member()/remove_user() and only move their own rows
+        self.sorted_keys = sorted(self.member_key(nick, modes) for nick, modes in self.members.items())
+        self.pending_rows.clear()
+        self.redraw_users = True
+        print(f"DEBUG - Updating users list for {self.channel_name}: {len(self.members)} users")  # Debug print
+        self.schedule_users_refresh()
+            
+    def end_batch_update(self):
+        """End a batch update and process pending updates"""
+        if self.batch_updating:
+            self.batch_updating = False
+            if self.names_buffer:
+                print(f"DEBUG - Processing batch update for {self.channel_name}")  # Debug print
+                print(f"DEBUG - Names buffer: {len(self.names_buffer)} members")  # Debug print
+                self.members = self.names_buffer
+                self.names_buffer = {}
+                # Parsed with the server's PREFIX of now, whatever the old bits followed
+                self.prefix_order = self.isupport.prefix_order
+                self.update_users_list()
+    
+    def _add_message_safe(self, message, tag=None):
+        """Internal method to safely add message in the GUI thread"""
+        try:
+            timestamp = datetime.now().strftime("[%H:%M:%S]")
+            
+            # Timestamp in gray, then the message's own segments
+            segments = [timestamp + " ", 'timestamp']
+            
+            # Handle different types of messages
+            if message.startswith('* '):  # System messages
+                if 'has joined' in message:
+                    segments += [message + '\n', 'join']
+                elif 'has left' in message:
+                    segments += [message + '\n', 'part']
+                elif 'has quit' in message:
+                    segments += [message + '\n', 'quit']
+                elif 'is now known as' in message:
+                    segments += [message + '\n', 'nick']
+                else:
+                    segments += [message + '\n', tag or 'message']
+            else:
+                # Regular chat messages
+                if ': ' in message:
+                    username, text = message.split(': ', 1)
+                    # Check if the message is from the current user
+                    current_nick = self.irc_client.connections[self.server].nickname
+                    if username == current_nick:
+                        segments += [username + ': ', 'my_username']
+                    else:
+                        segments += [username + ': ', 'username']
+                    segments += [text + '\n', tag or 'message']
+                else:
+                    segments += [message + '\n', tag or 'message']
+            
+            self.render(*segments)
+        except Exception as e:
+            print(f"Error in _add_message_safe: {e}")
+
+    def render(self, *segments):
+        """Keep a line's text/tag segments and show them if the window is open"""
+        self.recent.append(segments)
+        if self.view is not None:
+            self.view.render(*segments)
+
+    def add_message(self, message, tag=None):
+        """Add a message to the channel (Tk thread only)"""
+        if not self.is_closing:
+            self._add_message_safe(message, tag)
+
+
+class ChannelWindow:
+    """Window of an open Channel, drawing from its members and lines"""
+    def __init__(self, channel):
+        self.channel = channel
+        self.irc_client = irc_client = channel.irc_client
+        self.channel_name = channel_name = channel.channel_name
+        self.server = server = channel.server
+        self.render_buffer = []  # text, tags, text, tags... inserted once per frame
+        self.is_closing = False
         
         # Create window
         self.window = tk.Toplevel()
@@ -32,6 +334,11 @@ class ChannelWindow:
         # Create chat display with color tags
         self.chat_display = scrolledtext.ScrolledText(self.left_frame, wrap=tk.WORD)
         self.chat_display.pack(fill=tk.BOTH, expand=True)
+        self.scrollback = Scrollback(
+            self.chat_display,
+            irc_client.preferences['scrollback_lines'],
+            irc_client.preferences['scrollback_page']
+        )
         
         # Create input frame
         self.input_frame = ttk.Frame(self.left_frame)
@@ -65,9 +372,11 @@ class ChannelWindow:
         self.users_horizontal_scrollbar = ttk.Scrollbar(self.users_frame, orient=tk.HORIZONTAL)
         self.users_horizontal_scrollbar.pack(side=tk.BOTTOM, fill=tk.X)
         
-        # Create listbox
-        self.users_listbox = tk.Listbox(
+        # Create nick list, drawing only the rows in view from sorted_keys
+        self.users_listbox = NickList(
             self.users_frame,
+            lambda: len(channel.sorted_keys),
+            channel.user_row,
             yscrollcommand=self.users_scrollbar.set,
             xscrollcommand=self.users_horizontal_scrollbar.set,
             width=20,
@@ -126,12 +435,6 @@ class ChannelWindow:
 
 
         self.minimized = False
-        self.window.withdraw()  # Start minimized
-
-        # Add batch update variables
-        self.batch_updating = False
-        self.names_buffer = set()
-        self.is_closing = False
 
         # Add action color
         self.chat_display.tag_configure('action', foreground='yellow')
@@ -357,7 +660,8 @@ class ChannelWindow:
                 
                 self.users_listbox.configure(
                     bg=theme['bg'],
-                    fg=theme['fg']
+                    fg=theme['fg'],
+                    status_fg=theme['nick']
                 )
                 
                 # Configure text tags with theme colors
@@ -381,27 +685,10 @@ class ChannelWindow:
             print(f"Error applying theme: {e}")
             self.chat_display.insert(tk.END, f"Error applying theme: {e}\n", 'error')
 
-
-    def remove_user(self, user):
-        """Remove a user from the channel and update the UI"""
-        try:
-            # Remove user from set (handle both with and without prefix)
-            self.users.discard(user)
-            self.users.discard(f"@{user}")
-            self.users.discard(f"+{user}")
-            
-            # Update the users list
-            self.update_users_list()
-            
-             #0\ Update users count
-            self.users_label.config(text=f"Users ({len(self.users)})")
-            
-            print(f"DEBUG - Removed user {user} from {self.channel_name}")
-            
-        except Exception as e:
-            print(f"Error removing user: {e}")
-            self.chat_display.insert(tk.END, f"Error removing user: {e}\n", 'error')
-
+    @property
+    def isupport(self):
+        """Protocol details of this window's server"""
+        return self.channel.isupport
 
     def kick_user(self):
         """Kick selected user from channel"""
@@ -409,9 +696,8 @@ class ChannelWindow:
             selected = self.users_listbox.curselection()
             if selected:
                 user = self.users_listbox.get(selected[0])
-                # Remove @ or + if present
-                if user.startswith(('@', '+')):
-                    user = user[1:]
+                # Remove status prefixes if present
+                user = self.isupport.strip_prefix(user)
                     
                 # Create dialog for kick reason
                 reason_dialog = tk.Toplevel(self.window)
@@ -429,15 +715,13 @@ class ChannelWindow:
                     # Send kick command
                     self.irc_client.send_command(
                         f"KICK {self.channel_name} {user} :{reason}",
-                        self.server
+                        self.server,
+                        priority=True
                     )
                     
                     # Add kick message immediately (server will confirm)
                     timestamp = datetime.now().strftime("[%H:%M:%S]")
-                    self.chat_display.insert(tk.END, 
-                        f"{timestamp} * Attempting to kick {user} ({reason})\n", 
-                        'kick')
-                    self.chat_display.see(tk.END)
+                    self.channel.render(f"{timestamp} * Attempting to kick {user} ({reason})\n", 'kick')
                     
                     print(f"DEBUG - Kicking {user} from {self.channel_name}: {reason}")
                     reason_dialog.destroy()
@@ -458,13 +742,8 @@ class ChannelWindow:
             selected = self.users_listbox.curselection()
             if selected:
                 user = self.users_listbox.get(selected[0])
-                # Store the pending ban
-                self.irc_client.pending_bans[user] = self.channel_name
-                # Request WHOIS to get user's host
-                self.irc_client.send_command(f'WHOIS {user}', self.server)
-                # Remove @ or + if present
-                if user.startswith(('@', '+')):
-                    user = user[1:]
+                # Remove status prefixes if present
+                user = self.isupport.strip_prefix(user)
                     
                 # Create dialog for ban options
                 ban_dialog = tk.Toplevel(self.window)
@@ -502,12 +781,14 @@ class ChannelWindow:
                         # Simple nick ban
                         self.irc_client.send_command(
                             f"MODE {self.channel_name} +b {user}!*@*",
-                            self.server
+                            self.server,
+                            priority=True
                         )
                         if kick_after.get():
                             self.irc_client.send_command(
                                 f"KICK {self.channel_name} {user} :{reason}",
-                                self.server
+                                self.server,
+                                priority=True
                             )
                     
                     print(f"DEBUG - Banning {user} from {self.channel_name}: {reason}")
@@ -526,14 +807,14 @@ class ChannelWindow:
             selected = self.users_listbox.curselection()
             if selected:
                 user = self.users_listbox.get(selected[0])
-                # Remove @ or + if present
-                if user.startswith(('@', '+')):
-                    user = user[1:]
+                # Remove status prefixes if present
+                user = self.isupport.strip_prefix(user)
                     
                 # Send mode command to remove operator status
                 self.irc_client.send_command(
                     f"MODE {self.channel_name} -o {user}",
-                    self.server
+                    self.server,
+                    priority=True
                 )
                 print(f"DEBUG - Sending DeOP command for {user} in {self.channel_name}")
                 
@@ -547,14 +828,14 @@ class ChannelWindow:
             selected = self.users_listbox.curselection()
             if selected:
                 user = self.users_listbox.get(selected[0])
-                # Remove @ or + if present
-                if user.startswith(('@', '+')):
-                    user = user[1:]
+                # Remove status prefixes if present
+                user = self.isupport.strip_prefix(user)
                     
                 # Send mode command to remove voice status
                 self.irc_client.send_command(
                     f"MODE {self.channel_name} -v {user}",
-                    self.server
+                    self.server,
+                    priority=True
                 )
                 print(f"DEBUG - Sending DeVoice command for {user} in {self.channel_name}")
                 
@@ -568,14 +849,14 @@ class ChannelWindow:
             selected = self.users_listbox.curselection()
             if selected:
                 user = self.users_listbox.get(selected[0])
-                # Remove @ or + if present
-                if user.startswith(('@', '+')):
-                    user = user[1:]
+                # Remove status prefixes if present
+                user = self.isupport.strip_prefix(user)
                     
                 # Send mode command to give operator status
                 self.irc_client.send_command(
                     f"MODE {self.channel_name} +o {user}",
-                    self.server
+                    self.server,
+                    priority=True
                 )
                 print(f"DEBUG - Sending OP command for {user} in {self.channel_name}")
                 
@@ -589,14 +870,14 @@ class ChannelWindow:
             selected = self.users_listbox.curselection()
             if selected:
                 user = self.users_listbox.get(selected[0])
-                # Remove @ or + if present
-                if user.startswith(('@', '+')):
-                    user = user[1:]
+                # Remove status prefixes if present
+                user = self.isupport.strip_prefix(user)
                     
                 # Send mode command to give voice status
                 self.irc_client.send_command(
                     f"MODE {self.channel_name} +v {user}",
-                    self.server
+                    self.server,
+                    priority=True
                 )
                 print(f"DEBUG - Sending voice command for {user} in {self.channel_name}")
                 
@@ -605,18 +886,6 @@ class ChannelWindow:
             self.chat_display.insert(tk.END, f"Error giving voice status: {e}\n", 'error')
 
 
-    def begin_batch_update(self):
-        """Start a batch update of the users list"""
-        self.batch_updating = True
-        self.names_buffer.clear()
-
-
-    def add_action(self, sender, action_text):
-        timestamp = datetime.now().strftime("[%H:%M:%S]")
-        self.chat_display.insert(tk.END, f"{timestamp} ", 'timestamp')
-        self.chat_display.insert(tk.END, f"* {sender} {action_text}\n", 'action')
-        self.chat_display.see(tk.END)
-
     def show_user_menu(self, event):
         try:
             # Get clicked item
@@ -627,7 +896,7 @@ class ChannelWindow:
                 self.users_listbox.selection_set(clicked_index)
                 
                 # Get coordinates relative to the screen
-                x = self.users_listbox.winfo_IRCurd() + event.x
+                x = self.users_listbox.winfo_rootx() + event.x
                 y = self.users_listbox.winfo_rooty() + event.y
                 
                 # Show menu at mouse position
@@ -639,17 +908,15 @@ class ChannelWindow:
         selected = self.users_listbox.curselection()
         if selected:
             user = self.users_listbox.get(selected[0])
-            # Remove @ or + if present
-            if user.startswith(('@', '+')):
-                user = user[1:]
+            # Remove status prefixes if present
+            user = self.isupport.strip_prefix(user)
             self.irc_client.create_private_window(user, self.server)  # Pass the server
     
     def whois_user(self):
         selected = self.users_listbox.curselection()
         if selected:
             user = self.users_listbox.get(selected[0])
-            if user.startswith(('@', '+')):
-                user = user[1:]
+            user = self.isupport.strip_prefix(user)
             self.irc_client.send_command(f"WHOIS {user}")
 
         
@@ -665,158 +932,44 @@ class ChannelWindow:
                 # Send the message to the server
                 self.irc_client.send_command(f"PRIVMSG {self.channel_name} :{message}", self.server)
                 # Add our message locally immediately
-                current_nick = self.irc_client.connections[self.server]['nickname']
-                self.add_message(f"{current_nick}: {message}")  # No tag needed, will use default
+                current_nick = self.irc_client.connections[self.server].nickname
+                self.channel.add_message(f"{current_nick}: {message}")  # No tag needed, will use default
             self.message_input.delete(0, tk.END)
 
-    def _update_users_list_safe(self):
-        """Internal method to safely update users list in the GUI thread"""
-        try:
-            self.users_listbox.delete(0, tk.END)
-            for user in sorted(self.users):
-                self.users_listbox.insert(tk.END, user)
-        except Exception as e:
-            print(f"Error in _update_users_list_safe: {e}")
-            
-    def update_users_list(self):
-
-        """Update the users listbox safely"""
-        if not self.is_closing:
+    def refresh_users(self, rows, redraw):
+        """Show the member changes of the last frame"""
+        if redraw:
+            self.users_listbox.selection_clear(0, tk.END)
+        else:
+            self.users_listbox.shift_selection(rows)
+        self.users_listbox.redraw()
+        self.users_label.config(text=f"Users ({len(self.channel.members)})")
+
+    def render(self, *segments):
+        """Queue text/tag segments for this frame's single insert"""
+        if not self.render_buffer:
+            self.irc_client.dirty_windows.add(self)
+        self.render_buffer.extend(segments)
+
+    def flush_render(self):
+        """Insert everything rendered this frame in one call"""
+        segments, self.render_buffer = self.render_buffer, []
+        if segments and not self.is_closing:
             try:
-                self.window.after(0, self._update_users_list_safe)
+                self.scrollback.insert(*segments)
             except Exception as e:
-                print(f"Error updating users list: {e}")
-
-        """Update the users listbox with current users"""
-        try:
-            if not self.window.winfo_exists():
-                return
-                
-            print(f"DEBUG - Updating users list for {self.channel_name}")  # Debug print
-            print(f"DEBUG - Current users: {self.users}")  # Debug print
-            
-            self.users_listbox.delete(0, tk.END)
-            
-            # Sort users with ops (@) first, then voice (+), then regular users
-            sorted_users = sorted(self.users, key=lambda x: (
-                (0 if x.startswith('@') else 1 if x.startswith('+') else 2),
-                x.lstrip('@+').lower()
-            ))
-            
-            for user in sorted_users:
-                self.users_listbox.insert(tk.END, user)
-                
-            # Update users count
-            self.users_label.config(text=f"Users ({len(self.users)})")
-            print(f"DEBUG - Updated users list with {len(self.users)} users")  # Debug print
-            
-        except Exception as e:
-            print(f"Error updating users list: {e}")
-            
-    def end_batch_update(self):
-        """End a batch update and process pending updates"""
-        if self.batch_updating:
-            self.batch_updating = False
-            if self.names_buffer:
-                print(f"DEBUG - Processing batch update for {self.channel_name}")  # Debug print
-                print(f"DEBUG - Names buffer: {self.names_buffer}")  # Debug print
-                self.users = self.names_buffer.copy()
-                self.update_users_list()
-    
-    def _do_update_users_list(self):
-        try:
-            self.users_listbox.delete(0, tk.END)
-            
-            # Filter and sort users in a list comprehension for better performance
-            valid_users = sorted(
-                [user for user in self.users 
-                 if (user.startswith(('@', '+')) or user[0].isalnum()) and 
-                 not any(x in user.lower() for x in ['366', 'list', 'end', 'names'])],
-                key=lambda x: (not x.startswith('@'), not x.startswith('+'), x.lower())
-            )
-
-            # Update Users Count
-            self.users_label.config(text=f"Users: {len(valid_users)}")
-            
-            # Batch insert users
-            for i, user in enumerate(valid_users):
-                self.users_listbox.insert(tk.END, user)
-                if user.startswith('@'):
-                    self.users_listbox.itemconfig(i, foreground='yellow')
-                elif user.startswith('+'):
-                    self.users_listbox.itemconfig(i, foreground='cyan')
-                else:
-                    self.users_listbox.itemconfig(i, foreground='white')
-        finally:
-            self.batch_updating = False
-
-    def _add_message_safe(self, message, tag=None):
-        """Internal method to safely add message in the GUI thread"""
-        try:
-            timestamp = datetime.now().strftime("[%H:%M:%S]")
-            
-            # Insert timestamp with gray color
-            self.chat_display.insert(tk.END, timestamp + " ", 'timestamp')
-            
-            # Handle different types of messages
-            if message.startswith('* '):  # System messages
-                if 'has joined' in message:
-                    self.chat_display.insert(tk.END, message + '\n', 'join')
-                elif 'has left' in message:
-                    self.chat_display.insert(tk.END, message + '\n', 'part')
-                elif 'has quit' in message:
-                    self.chat_display.insert(tk.END, message + '\n', 'quit')
-                elif 'is now known as' in message:
-                    self.chat_display.insert(tk.END, message + '\n', 'nick')
-            else:
-                # Regular chat messages
-                if ': ' in message:
-                    username, text = message.split(': ', 1)
-                    # Check if the message is from the current user
-                    current_nick = self.irc_client.connections[self.server]['nickname']
-                    if username == current_nick:
-                        self.chat_display.insert(tk.END, username + ': ', 'my_username')
-                    else:
-                        self.chat_display.insert(tk.END, username + ': ', 'username')
-                    self.chat_display.insert(tk.END, text + '\n', tag or 'message')
-                else:
-                    self.chat_display.insert(tk.END, message + '\n', tag or 'message')
-            
-            self.chat_display.see(tk.END)
-            self.chat_display.update()
-        except Exception as e:
-            print(f"Error in _add_message_safe: {e}")
+                print(f"Error rendering messages: {e}")
 
 
         
-    def add_message(self, message, tag=None):
-
-        """Add a message to the chat display safely"""
-        """Add a message to the chat display safely"""
-        if not self.is_closing:
-            try:
-                self.window.after(0, self._add_message_safe, message, tag)
-            except Exception as e:
-                print(f"Error adding message: {e}")
-            
     def on_closing(self):
-        """Handle window closing properly"""
-        try:
-            self.is_closing = True
-            # Remove channel from network tree
-            server_data = self.irc_client.server_nodes.get(self.server)  # Use self.server instead of current_server
-            if server_data and self.channel_name in server_data['channels']:
-                self.irc_client.network_tree.delete(server_data['channels'][self.channel_name])
-                del server_data['channels'][self.channel_name]
-
-            # Clean up channel windows dict
-            channel_key = f"{self.server}:{self.channel_name}"
-            if channel_key in self.irc_client.channel_windows:
-                del self.irc_client.channel_windows[channel_key]
-            self.irc_client.send_command(f"PART {self.channel_name}", self.server)
-            self.window.destroy()
-        except Exception as e:
-            print(f"Error in on_closing: {e}")
+        """Closing a channel window leaves the channel"""
+        self.channel.part()
+
+    def destroy(self):
+        self.is_closing = True
+        self.scrollback.close()
+        self.window.destroy()
 
     def toggle_visibility(self):
         if self.minimized:
@@ -841,6 +994,11 @@ class PrivateWindow:
         # Create chat display
         self.chat_display = scrolledtext.ScrolledText(self.window, wrap=tk.WORD)
         self.chat_display.pack(fill=tk.BOTH, expand=True)
+        self.scrollback = Scrollback(
+            self.chat_display,
+            irc_client.preferences['scrollback_lines'],
+            irc_client.preferences['scrollback_page']
+        )
         
         # Configure text tags
         self.chat_display.tag_configure('timestamp', foreground='gray')
@@ -870,70 +1028,1319 @@ class PrivateWindow:
         # Add action color
         self.chat_display.tag_configure('action', foreground='yellow')
 
+        self.render_buffer = []  # text, tags, text, tags... inserted once per frame
+
 
     def add_action(self, sender, action_text):
             timestamp = datetime.now().strftime("[%H:%M:%S]")
-            self.chat_display.insert(tk.END, f"{timestamp} ", 'timestamp')
-            self.chat_display.insert(tk.END, f"* {sender} {action_text}\n", 'action')
-            self.chat_display.see(tk.END)
+            self.render(f"{timestamp} ", 'timestamp', f"* {sender} {action_text}\n", 'action')
+
+    def render(self, *segments):
+        """Queue text/tag segments for this frame's single insert"""
+        if not self.render_buffer:
+            self.irc_client.dirty_windows.add(self)
+        self.render_buffer.extend(segments)
+
+    def flush_render(self):
+        """Insert everything rendered this frame in one call"""
+        segments, self.render_buffer = self.render_buffer, []
+        if segments:
+            try:
+                self.scrollback.insert(*segments)
+            except Exception as e:
+                print(f"Error rendering messages: {e}")
 
     def on_closing(self):
         # Remove PM node from correct server's tree section
-        server_data = self.irc_client.server_nodes.get(self.server)  # Use self.server instead
-        if server_data and self.username in server_data['private_msgs']:
-            self.irc_client.network_tree.delete(server_data['private_msgs'][self.username])
-            del server_data['private_msgs'][self.username]
+        self.irc_client.remove_pm_node(self.username, self.server)
                 
         # Clean up private windows dict
-        if self.username in self.irc_client.private_windows:
-            del self.irc_client.private_windows[self.username]
+        self.irc_client.private_windows.pop(
+            self.irc_client.window_key(self.server, self.username), None
+        )
             
         # Destroy window
+        self.scrollback.close()
         self.window.destroy()
         
     def send_message(self, event=None):
         message = self.message_input.get()
         if message:
             self.irc_client.send_private_message(self.username, message, self.server)
-            self.add_message(f"{self.irc_client.connections[self.server]['nickname']}: {message}")
+            self.add_message(f"{self.irc_client.connections[self.server].nickname}: {message}")
             self.message_input.delete(0, tk.END)
             
     def add_message(self, message):
         timestamp = datetime.now().strftime("[%H:%M:%S]")
-        self.chat_display.insert(tk.END, timestamp + " ", 'timestamp')
+        segments = [timestamp + " ", 'timestamp']
         
         if ': ' in message:
             username, text = message.split(': ', 1)
-            current_nick = self.irc_client.connections[self.server]['nickname']
+            current_nick = self.irc_client.connections[self.server].nickname
             if username == current_nick:
-                self.chat_display.insert(tk.END, username + ': ', 'my_username')
+                segments += [username + ': ', 'my_username']
             else:
-                self.chat_display.insert(tk.END, username + ': ', 'username')
-            self.chat_display.insert(tk.END, text + '\n', 'message')
+                segments += [username + ': ', 'username']
+            segments += [text + '\n', 'message']
         else:
-            self.chat_display.insert(tk.END, message + '\n', 'message')
+            segments += [message + '\n', 'message']
             
-        self.chat_display.see(tk.END)
-        
+        self.render(*segments)
+
+
+class ScrollbackStore:
+    """Chat lines trimmed from a window, spilled to an anonymous temporary file"""
+    def __init__(self):
+        self.file = tempfile.TemporaryFile()
+        self.offsets = array('q', [0])  # Start of every stored line, then the end of the file
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def append(self, text):
+        """Store newline-terminated lines after the ones already stored"""
+        data = text.encode('utf-8')
+        base = self.offsets[-1]
+        self.file.seek(base)
+        self.file.write(data)
+        offsets = self.offsets
+        end = data.find(b'\n')
+        while end >= 0:
+            offsets.append(base + end + 1)
+            end = data.find(b'\n', end + 1)
+
+    def read(self, start, end):
+        """Text of stored lines start..end-1"""
+        self.file.seek(self.offsets[start])
+        return self.file.read(self.offsets[end] - self.offsets[start]).decode('utf-8')
+
+    def close(self):
+        self.file.close()
+
+
+class Scrollback:
+    """Keeps a chat widget to a bounded number of lines, paging older ones from disk"""
+    def __init__(self, widget, limit=5000, page=500):
+        self.widget = widget
+        self.limit = limit  # Lines kept in the widget
+        self.page = page    # Lines brought back per scroll to the top
+        self.store = ScrollbackStore()
+        # Stored lines older than the widget's first line; the stored lines
+        # after it are the ones paged back in and still shown on top
+        self.cursor = 0
+        self.paging = False
+        widget.tag_configure('history', foreground='gray')
+        # Watch the view through the scrollbar callback to spot the top
+        self.scrollbar_set = widget.vbar.set
+        widget.configure(yscrollcommand=self.scrolled)
+
+    def insert(self, *segments):
+        """Append text/tag segments, following the end unless the user is reading history"""
+        widget = self.widget
+        # Taken before the insert, which moves the end away from a view that was at it
+        reading = widget.yview()[1] < 1.0
+        widget.insert(tk.END, *segments)
+        if not reading:
+            widget.see(tk.END)
+        self.trim(reading)
+
+    def trim(self, reading=False):
+        """Trim from the top in bulk once the widget is well past its limit"""
+        widget = self.widget
+        lines = int(widget.index('end-1c').split('.')[0])
+        if lines <= self.limit + self.limit // 10:
+            return
+        if reading and lines < 2 * self.limit:
+            return  # Leave the user's history alone while they are scrolled up
+        excess = lines - self.limit
+        # Lines paged in from the store are already on disk
+        paged_in = min(excess, len(self.store) - self.cursor)
+        self.cursor += paged_in
+        if excess > paged_in:
+            self.store.append(widget.get(f"{paged_in + 1}.0", f"{excess + 1}.0"))
+            self.cursor = len(self.store)
+        widget.delete('1.0', f"{excess + 1}.0")
+
+    def scrolled(self, first, last):
+        self.scrollbar_set(first, last)
+        if float(first) <= 0.0 and self.cursor and not self.paging:
+            self.paging = True
+            self.widget.after_idle(self.page_in)
+
+    def page_in(self):
+        """Bring the previous page of stored lines back above the first line"""
+        self.paging = False
+        start = max(0, self.cursor - self.page)
+        count = self.cursor - start
+        if not count:
+            return
+        self.widget.insert('1.0', self.store.read(start, self.cursor), 'history')
+        self.cursor = start
+        # Keep the line the user was looking at in place
+        self.widget.yview(f"{count + 1}.0")
+
+    def close(self):
+        self.store.close()
+
+
+class NickList:
+    """Canvas nick list that draws only the rows in view, with the Listbox calls the window uses"""
+    def __init__(self, parent, count, row, yscrollcommand=None, xscrollcommand=None, width=20, height=5):
+        self.count = count  # Callable returning the number of rows
+        self.row = row      # Callable returning (text, mode bits) of a row
+        self.font = tkfont.nametofont('TkDefaultFont')
+        self.row_height = self.font.metrics('linespace') + 1
+        self.canvas = tk.Canvas(
+            parent,
+            width=width * self.font.measure('0'),
+            height=height * self.row_height,
+            bg='white',
+            highlightthickness=0,
+            xscrollcommand=xscrollcommand
+        )
+        self.yscrollcommand = yscrollcommand
+        self.fill = 'black'           # Members without status
+        self.status_fill = 'blue'     # Voiced and above
+        self.select_fill = 'white'
+        self.top = 0                  # Row drawn at the top of the canvas
+        self.selected = None          # Selected row, single selection like the old Listbox
+        self.widest = 0               # Widest row drawn so far, for horizontal scrolling
+        self.items = []               # One pooled text item per visible row
+        self.highlight = self.canvas.create_rectangle(0, 0, 0, 0, fill='#3399ff', width=0, state='hidden')
+        self.canvas.bind('<Configure>', lambda event: self.redraw())
+        self.canvas.bind('<Button-1>', self.click)
+        self.canvas.bind('<MouseWheel>', self.wheel)
+        self.canvas.bind('<Button-4>', lambda event: self.yview_scroll(-3, 'units'))
+        self.canvas.bind('<Button-5>', lambda event: self.yview_scroll(3, 'units'))
+
+    def __getattr__(self, name):
+        # pack, bind, xview, winfo_* and the rest go straight to the canvas
+        return getattr(self.canvas, name)
+
+    def configure(self, **options):
+        """Accepts bg, fg and status_fg like a Listbox with a second foreground"""
+        self.fill = options.pop('fg', self.fill)
+        self.status_fill = options.pop('status_fg', self.status_fill)
+        self.canvas.configure(**options)
+        self.redraw()
+
+    config = configure
+
+    def visible_rows(self):
+        return max(1, self.canvas.winfo_height() // self.row_height)
+
+    def redraw(self):
+        """Draw the rows in view, reusing the same text items every time"""
+        canvas = self.canvas
+        row_height = self.row_height
+        count = self.count()
+        visible = self.visible_rows()
+        self.top = max(0, min(self.top, count - visible))
+        end = min(count, self.top + visible + 1)  # Include the partly shown last row
+        while len(self.items) < end - self.top:
+            self.items.append(canvas.create_text(2, 0, anchor='nw', font=self.font))
+        for slot, item in enumerate(self.items):
+            index = self.top + slot
+            if index >= end:
+                canvas.itemconfigure(item, state='hidden')
+                continue
+            text, modes = self.row(index)
+            if index == self.selected:
+                fill = self.select_fill
+            else:
+                fill = self.status_fill if modes else self.fill
+            canvas.itemconfigure(item, text=text, fill=fill, state='normal')
+            canvas.coords(item, 2, slot * row_height)
+            self.widest = max(self.widest, self.font.measure(text) + 4)
+        width = max(self.widest, canvas.winfo_width())
+        canvas.configure(scrollregion=(0, 0, width, canvas.winfo_height()))
+        if self.selected is not None and self.top <= self.selected < end:
+            slot = self.selected - self.top
+            canvas.coords(self.highlight, 0, slot * row_height, width, (slot + 1) * row_height)
+            canvas.itemconfigure(self.highlight, state='normal')
+        else:
+            canvas.itemconfigure(self.highlight, state='hidden')
+        if self.yscrollcommand:
+            self.yscrollcommand(*self.yview())
+
+    def yview(self, *args):
+        """Listbox-style yview: fractions in view, or 'moveto'/'scroll' from the scrollbar"""
+        count = self.count()
+        if not args:
+            if not count:
+                return (0.0, 1.0)
+            return (self.top / count, min(1.0, (self.top + self.visible_rows()) / count))
+        if args[0] == 'moveto':
+            self.top = int(float(args[1]) * count)
+        elif args[0] == 'scroll':
+            step = self.visible_rows() if args[2] == 'pages' else 1
+            self.top += int(args[1]) * step
+        self.redraw()
+
+    def yview_scroll(self, number, what):
+        self.yview('scroll', number, what)
+
+    def wheel(self, event):
+        self.yview_scroll(-3 if event.delta > 0 else 3, 'units')
+
+    def click(self, event):
+        index = self.nearest(event.y)
+        if index >= 0:
+            self.selection_set(index)
+
+    def nearest(self, y):
+        """Row under a y coordinate of the widget, -1 when the list is empty"""
+        return min(self.count() - 1, self.top + max(0, int(y)) // self.row_height)
+
+    def get(self, index):
+        return self.row(index)[0]
+
+    def curselection(self):
+        return () if self.selected is None else (self.selected,)
+
+    def selection_set(self, index):
+        self.selected = index
+        self.redraw()
+
+    def selection_clear(self, first, last=None):
+        self.selected = None
+        self.redraw()
+
+    def shift_selection(self, rows):
+        """Keep the selection on its member across (index, text or None) row edits"""
+        selected = self.selected
+        for index, text in rows:
+            if selected is None:
+                break
+            if text is None:
+                if index == selected:
+                    selected = None
+                elif index < selected:
+                    selected -= 1
+            elif index <= selected:
+                selected += 1
+        self.selected = selected
+
+
+class Message:
+    """A parsed IRC line: RFC 1459 with IRCv3 message tags"""
+    __slots__ = ('tags', 'prefix', 'nick', 'user', 'host', 'command', 'params')
+
+    TAG_ESCAPES = {':': ';', 's': ' ', '\\': '\\', 'r': '\r', 'n': '\n'}
+
+    def __init__(self, tags, prefix, nick, user, host, command, params):
+        self.tags = tags          # Dict of IRCv3 tags, or None
+        self.prefix = prefix      # Raw prefix without the leading ':', or None
+        self.nick = nick          # Nick (or server name) from the prefix
+        self.user = user
+        self.host = host
+        self.command = command    # Upper-case command or three-digit numeric
+        self.params = params      # Middle params plus the trailing one, if any
+
+    @property
+    def trailing(self):
+        """Last parameter, usually the free-form text"""
+        return self.params[-1] if self.params else ''
+
+    @classmethod
+    def parse(cls, line):
+        """Tokenize a line in a single pass"""
+        tags = None
+        if line[:1] == '@':
+            raw_tags, _, line = line[1:].partition(' ')
+            tags = {}
+            for tag in raw_tags.split(';'):
+                key, _, value = tag.partition('=')
+                tags[key] = cls.unescape_tag(value) if '\\' in value else value
+            line = line.lstrip(' ')
+
+        prefix = nick = user = host = None
+        if line[:1] == ':':
+            prefix, _, line = line[1:].partition(' ')
+            line = line.lstrip(' ')
+            nick, _, host = prefix.partition('@')
+            nick, _, user = nick.partition('!')
+            user = user or None
+            host = host or None
+
+        trailing = None
+        if line[:1] == ':':
+            line, trailing = '', line[1:]
+        else:
+            split = line.find(' :')
+            if split >= 0:
+                line, trailing = line[:split], line[split + 2:]
+        params = line.split()
+        command = params.pop(0).upper() if params else ''
+        if trailing is not None:
+            params.append(trailing)
+        return cls(tags, prefix, nick, user, host, command, params)
+
+    @classmethod
+    def unescape_tag(cls, value):
+        result = []
+        chars = iter(value)
+        for char in chars:
+            if char == '\\':
+                escaped = next(chars, '')
+                result.append(cls.TAG_ESCAPES.get(escaped, escaped))
+            else:
+                result.append(char)
+        return ''.join(result)
+
+
+class HandlerStats:
+    """Per-handler call counts and log2 latency histograms"""
+    BUCKETS = 48  # 2**47 ns is well over a day
+
+    def __init__(self, enabled=True, budget=0.05):
+        self.enabled = enabled                # When off, dispatch skips the clock entirely
+        self.budget_ns = int(budget * 1e9)    # Warn when one line takes longer than this
+        self.handlers = {}                    # (command, handler) -> [calls, total_ns, max_ns, histogram]
+        self.slow_lines = 0
+
+    def record(self, command, handler, elapsed):
+        entry = self.handlers.get((command, handler))
+        if entry is None:
+            entry = self.handlers[(command, handler)] = [0, 0, 0, [0] * self.BUCKETS]
+        entry[0] += 1
+        entry[1] += elapsed
+        if elapsed > entry[2]:
+            entry[2] = elapsed
+        entry[3][min(elapsed.bit_length(), self.BUCKETS - 1)] += 1
+
+    def reset(self):
+        self.handlers.clear()
+        self.slow_lines = 0
+
+    @staticmethod
+    def percentile(histogram, calls, fraction):
+        """Upper bound in ns of the bucket holding the given fraction of calls"""
+        wanted = calls * fraction
+        seen = 0
+        for bucket, count in enumerate(histogram):
+            seen += count
+            if seen >= wanted:
+                return 1 << bucket
+        return 1 << (len(histogram) - 1)
+
+    def summary(self, limit=10):
+        """Rows of (name, calls, total_ns, p99_ns, max_ns), slowest total first"""
+        rows = []
+        for (command, handler), (calls, total, worst, histogram) in self.handlers.items():
+            name = f"{command} {getattr(handler, '__name__', repr(handler))}"
+            rows.append((name, calls, total, self.percentile(histogram, calls, 0.99), worst))
+        by_total = sorted(rows, key=lambda row: row[2], reverse=True)[:limit]
+        by_p99 = sorted(rows, key=lambda row: row[3], reverse=True)[:limit]
+        return by_total, by_p99
+
+
+class ReceiveBuffer:
+    """Preallocated receive buffer filled with recv_into and scanned in place"""
+    SIZE = 16384
+    MAX_LINE = 512 + 8191  # Longest line a server may send: 512 bytes plus message tags
+    pool = []  # Released buffers, reused by the next connection (I/O thread only)
+
+    @classmethod
+    def acquire(cls):
+        """Take a buffer from the pool, or allocate a new one"""
+        return cls.pool.pop() if cls.pool else cls()
+
+    def __init__(self, size=SIZE):
+        self.data = bytearray(size)
+        self.view = memoryview(self.data)
+        self.start = 0  # First byte not yet consumed
+        self.end = 0    # One past the last byte received
+        self.skipping = False  # Dropping the rest of an overlong line
+
+    def release(self):
+        """Return the buffer to the pool"""
+        self.start = self.end = 0
+        self.skipping = False
+        ReceiveBuffer.pool.append(self)
+
+    def recv_from(self, sock):
+        """Read straight into the free tail of the buffer, returning the byte count"""
+        if self.end == len(self.data) or (self.start and len(self.data) - self.end < 1024):
+            self.compact()
+        received = sock.recv_into(self.view[self.end:])
+        self.end += received
+        return received
+
+    def compact(self):
+        """Move the unconsumed bytes, never more than MAX_LINE, to the front"""
+        length = self.end - self.start
+        self.data[:length] = self.view[self.start:self.end]
+        self.start = 0
+        self.end = length
+
+    def complete(self):
+        """Consume the complete lines received so far as one CRLF-separated view, or None"""
+        # A line longer than MAX_LINE is dropped up to its CRLF, so the
+        # buffer never has to grow
+        data = self.data
+        if self.skipping:
+            pos = data.find(b'\r\n', self.start, self.end)
+            if pos < 0:
+                self.drop()
+                return None
+            self.start = pos + 2
+            self.skipping = False
+        last = data.rfind(b'\r\n', self.start, self.end)
+        if last < 0:
+            if self.end - self.start > self.MAX_LINE:
+                self.drop()
+                self.skipping = True
+                print(f"DEBUG - Dropped a line longer than {self.MAX_LINE} bytes")
+            return None
+        lines = self.view[self.start:last]
+        self.start = last + 2
+        if self.start == self.end:
+            self.start = self.end = 0  # Buffer drained, no need to compact later
+        return lines
+
+    def drop(self):
+        """Discard the unconsumed bytes, keeping a CR whose LF hasn't arrived yet"""
+        if self.end > self.start and self.data[self.end - 1] == 13:
+            self.data[0] = 13
+            self.end = 1
+        else:
+            self.end = 0
+        self.start = 0
+
+
+class TokenBucket:
+    """Token-bucket rate limiter for outgoing lines"""
+    def __init__(self, burst=5, rate=0.5):
+        self.burst = burst  # Lines that may be sent back to back
+        self.rate = rate    # Tokens refilled per second
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def consume(self, now):
+        """Take a token if one is available"""
+        self.refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def charge(self, now):
+        """Account for a line that bypassed the bucket"""
+        self.refill(now)
+        self.tokens = max(self.tokens - 1, 0.0)
+
+    def delay(self):
+        """Seconds until the next token is available"""
+        return max((1 - self.tokens) / self.rate, 0.0)
+
+
+class ISupport:
+    """Server capabilities from RPL_ISUPPORT (005), with lookup tables built once"""
+    FOLD_CACHE_SIZE = 10000  # Folded names kept before the cache starts over
+
+    CASEMAPPINGS = {
+        'ascii': str.maketrans(string.ascii_uppercase, string.ascii_lowercase),
+        'rfc1459': str.maketrans(string.ascii_uppercase + '[]\\~', string.ascii_lowercase + '{}|^'),
+        'strict-rfc1459': str.maketrans(string.ascii_uppercase + '[]\\', string.ascii_lowercase + '{}|'),
+    }
+
+    def __init__(self):
+        self.tokens = {}  # Every advertised token, raw value or True
+        # RFC 1459 defaults until the server says otherwise
+        self.set_prefix('(ov)@+')
+        self.set_chanmodes('beI,k,l,imnpst')
+        self.chantypes = frozenset('#&')
+        self.set_casemapping('rfc1459')
+        self.modes = 3  # Mode changes with an argument per MODE line, None for unlimited
+
+    def update(self, tokens):
+        """Apply the tokens of one 005 line"""
+        for token in tokens:
+            if token.startswith('-'):
+                key, value = token[1:].upper(), None
+                self.tokens.pop(key, None)
+            else:
+                key, _, value = token.partition('=')
+                key = key.upper()
+                self.tokens[key] = value or True
+
+            if key == 'PREFIX':
+                self.set_prefix('(ov)@+' if value is None else value)
+            elif key == 'CHANMODES':
+                self.set_chanmodes('beI,k,l,imnpst' if value is None else value)
+            elif key == 'CHANTYPES':
+                self.chantypes = frozenset('#&' if value is None else value)
+            elif key == 'CASEMAPPING':
+                self.set_casemapping(value or 'rfc1459')
+            elif key == 'MODES':
+                self.modes = int(value) if value else (3 if value is None else None)
+
+    def set_prefix(self, value):
+        modes, _, prefixes = value[1:].partition(')')
+        self.prefix_modes = dict(zip(modes, prefixes))   # Mode -> prefix, highest rank first
+        self.prefix_to_mode = dict(zip(prefixes, modes))
+        self.prefixes = ''.join(self.prefix_modes.values())
+        self.prefix_order = ''.join(self.prefix_modes)  # Mode letters, in bit order
+        # Status is kept as bits, bit 0 for the highest rank
+        self.mode_bits = {mode: 1 << rank for rank, mode in enumerate(self.prefix_modes)}
+        self.prefix_bits = {prefix: 1 << rank for rank, prefix in enumerate(self.prefixes)}
+
+    def set_chanmodes(self, value):
+        types = value.split(',')
+        types += [''] * (4 - len(types))
+        self.chanmodes = tuple(types[:4])  # Types A (list), B (always arg), C (arg when set), D (flag)
+
+    def set_casemapping(self, name):
+        self.casemapping = name.lower()
+        self.casemap = self.CASEMAPPINGS.get(self.casemapping, self.CASEMAPPINGS['ascii'])
+        self.folded = {}  # Name -> folded name, only valid for this casemapping
+
+    def fold(self, name):
+        """Case-fold a nick or channel name the way the server compares them"""
+        folded = self.folded.get(name)
+        if folded is None:
+            if len(self.folded) >= self.FOLD_CACHE_SIZE:
+                self.folded.clear()
+            folded = self.folded[name] = sys.intern(name.translate(self.casemap))
+        return folded
+
+    def is_channel(self, name):
+        return name[:1] in self.chantypes
+
+    def strip_prefix(self, name):
+        """Nick without the status prefixes of a NAMES entry"""
+        return name.lstrip(self.prefixes)
+
+    def parse_name(self, name):
+        """Split a NAMES entry such as '@+nick' into (nick, mode bits)"""
+        nick = name.lstrip(self.prefixes)
+        modes = 0
+        for prefix in name[:len(name) - len(nick)]:
+            modes |= self.prefix_bits[prefix]
+        return nick, modes
+
+    def rank(self, modes):
+        """Sort rank of a member's highest status, lower ranks first"""
+        return (modes & -modes).bit_length() - 1 if modes else len(self.prefixes)
+
+    def prefix_of(self, modes):
+        """Prefix shown for a member's highest status, '' for none or an unknown bit"""
+        rank = (modes & -modes).bit_length() - 1
+        return self.prefixes[rank:rank + 1]
+
+    def remap(self, modes, order):
+        """Bits recorded under another PREFIX's mode order, as bits of this one"""
+        bits = 0
+        for rank, mode in enumerate(order):
+            if modes >> rank & 1:
+                bits |= self.mode_bits.get(mode, 0)  # Modes this PREFIX lacks are dropped
+        return bits
+
+    def parse_modes(self, modes, args):
+        """Split a mode string and its arguments into (adding, mode, arg) changes"""
+        list_modes, always_arg, set_arg, _ = self.chanmodes
+        args = iter(args)
+        changes = []
+        adding = True
+        for mode in modes:
+            if mode == '+':
+                adding = True
+            elif mode == '-':
+                adding = False
+            else:
+                # Prefix, list (A) and key (B) modes always take an argument,
+                # limit-style (C) modes only when set, flags (D) never
+                if (mode in self.prefix_modes or mode in list_modes or mode in always_arg
+                        or (adding and mode in set_arg)):
+                    arg = next(args, None)
+                else:
+                    arg = None
+                changes.append((adding, mode, arg))
+        return changes
+
+
+class ServerConnection:
+    """State of a single server connection"""
+    def __init__(self, server, port, nickname, encoding='utf-8', fallback_encoding='latin-1',
+                 flood_burst=5, flood_rate=0.5, write_budget=4096,
+                 heartbeat_interval=30, lag_threshold=90):
+        self.server = server
+        self.port = port
+        self.nickname = nickname
+        self.encoding = codecs.lookup(encoding).name
+        self.fallback_encoding = codecs.lookup(fallback_encoding).name
+
+        # Socket and buffers are only touched by the network engine's thread;
+        # other threads hand work over through NetworkEngine.call_soon()
+        self.socket = None  # Set by the engine once a connection attempt wins
+        self.channels = {}
+        self.buffer = None  # ReceiveBuffer, attached by the engine on register
+        self.sendq = deque()          # Bulk lines, released by the flood control bucket
+        self.priorityq = deque()      # Protocol-critical lines that bypass the bucket
+        self.wireq = deque()          # Lines admitted for writing
+        self.send_offset = 0          # Bytes of wireq[0] already written
+        self.flush_scheduled = False  # A flush is pending on the I/O thread
+        self.read_paused = False      # Reads stopped until the GUI catches up
+        self.write_budget = write_budget  # Max bytes coalesced into one write
+
+        # Flood control
+        self.bucket = TokenBucket(flood_burst, flood_rate)
+        self.throttle_timer = None
+        self.throttled_since = None
+        self.throttled_time = 0.0
+
+        # Connection establishment (happy eyeballs)
+        self.addresses = deque()  # Resolved addresses not tried yet
+        self.attempts = []        # Sockets with a connect() in flight
+        self.attempt_timer = None
+        self.connect_timer = None
+        self.last_error = None
+        self.closed = False
+
+        # Heartbeat and lag measurement
+        self.heartbeat_interval = heartbeat_interval  # Seconds between client PINGs
+        self.lag_threshold = lag_threshold            # Seconds without PONG before the link is dead
+        self.heartbeat_timer = None
+        self.ping_token = None
+        self.ping_sent_at = None
+        self.lag = None  # Last measured round trip in seconds
+
+        # Reconnect supervision
+        self.auto_reconnect = False  # Set once registered, carried over to reconnects
+        self.reconnect_attempts = 0
+        self.registered = False  # RPL_WELCOME received on this connection
+        self.nick_attempts = 0   # Alternate nicks tried while registering
+
+        # Protocol details advertised in RPL_ISUPPORT (005)
+        self.isupport = ISupport()
+
+        # Folded nick -> folded names of the joined channels they are in,
+        # so QUIT and NICK only visit the channels they concern
+        self.memberships = {}
+
+    def heartbeat_reply(self, token):
+        """Record the round trip of our heartbeat PING; returns False for other PONGs"""
+        if self.ping_token is None or token != self.ping_token:
+            return False
+        # The token carries the send time, so the lag is measured from it directly
+        self.lag = (time.monotonic_ns() - int(token.split('-', 1)[1])) / 1e9
+        self.ping_token = self.ping_sent_at = None
+        return True
+
+    def add_member(self, nick, channel):
+        fold = self.isupport.fold
+        self.memberships.setdefault(fold(nick), set()).add(fold(channel))
+
+    def remove_member(self, nick, channel):
+        fold = self.isupport.fold
+        folded = fold(nick)
+        channels = self.memberships.get(folded)
+        if channels is not None:
+            channels.discard(fold(channel))
+            if not channels:
+                del self.memberships[folded]
+
+    def remove_nick(self, nick):
+        """Drop a nick that quit; returns the folded channels it was in"""
+        return self.memberships.pop(self.isupport.fold(nick), set())
+
+    def rename_member(self, old, new):
+        """Move a nick's memberships to its new nick; returns the folded channels"""
+        channels = self.remove_nick(old)
+        if channels:
+            self.memberships.setdefault(self.isupport.fold(new), set()).update(channels)
+        return channels
+
+    def forget_channel(self, channel):
+        """Drop every membership of a channel we left"""
+        folded = self.isupport.fold(channel)
+        for nick in [nick for nick, channels in self.memberships.items() if folded in channels]:
+            self.memberships[nick].discard(folded)
+            if not self.memberships[nick]:
+                del self.memberships[nick]
+
+    def decode_lines(self, raw):
+        """Decode a CRLF-separated block of complete lines into a list of lines"""
+        # One decode and one split for the whole block; only a block with an
+        # invalid line is decoded line by line, so the fallback stays per line
+        try:
+            return str(raw, self.encoding).split('\r\n')
+        except UnicodeDecodeError:
+            return [self.decode_line(line) for line in bytes(raw).split(b'\r\n')]
+
+    def decode_line(self, raw):
+        """Decode one complete line, falling back when it isn't valid in the main encoding"""
+        # Lines are complete, so a one-shot decode straight from the buffer
+        # view is enough; no decoder state has to be carried between reads
+        try:
+            return str(raw, self.encoding)
+        except UnicodeDecodeError:
+            return str(raw, self.fallback_encoding, 'replace')
+
+
+class NetworkEngine:
+    """Multiplex every server socket on a single selector-driven I/O thread"""
+    ATTEMPT_DELAY = 0.25   # Head start of each connection attempt before racing the next (RFC 8305)
+    CONNECT_TIMEOUT = 30   # Seconds before giving up on all attempts
+
+    def __init__(self, irc_client):
+        self.irc_client = irc_client
+        self.selector = selectors.DefaultSelector()  # epoll on Linux
+        self.resolver = ThreadPoolExecutor(max_workers=4, thread_name_prefix="IRCurd-dns")
+        self.running = False
+        self.thread = None
+
+        # Work handed over by other threads; deque append/popleft are atomic
+        self.pending = deque()
+        self.timers = []  # Heap of [deadline, sequence, callback, args]
+        self.timer_sequence = 0
+        self.paused = []  # Connections not read from until resume_reading()
+
+        # Socket pair used to wake the selector from other threads
+        self.wakeup_reader, self.wakeup_writer = socket.socketpair()
+        self.wakeup_reader.setblocking(False)
+        self.wakeup_writer.setblocking(False)
+        self.selector.register(self.wakeup_reader, selectors.EVENT_READ, None)
+
+    def start(self):
+        """Start the I/O thread"""
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="IRCurd-network")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self, timeout=2.0):
+        """Stop the I/O thread, closing every socket, and wait at most timeout seconds"""
+        self.running = False
+        self.wakeup()
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(timeout)
+
+    def wakeup(self):
+        """Interrupt a blocking select() call"""
+        try:
+            self.wakeup_writer.send(b'\0')
+        except OSError:
+            pass  # Pipe already full, the loop will wake up anyway
+
+    def call_soon(self, callback, *args):
+        """Run callback on the I/O thread"""
+        self.pending.append((callback, args))
+        self.wakeup()
+
+    def call_later(self, delay, callback, *args):
+        """Run callback on the I/O thread after delay seconds (I/O thread only)"""
+        self.timer_sequence += 1
+        timer = [time.monotonic() + delay, self.timer_sequence, callback, args]
+        heapq.heappush(self.timers, timer)
+        return timer
+
+    def cancel_timer(self, timer):
+        """Cancel a timer returned by call_later"""
+        timer[2] = None
+
+    def connect(self, conn):
+        """Resolve and connect conn in the background"""
+        future = self.resolver.submit(
+            socket.getaddrinfo, conn.server, conn.port, 0, socket.SOCK_STREAM
+        )
+        future.add_done_callback(lambda f: self.call_soon(self._resolved, conn, f))
+
+    def send(self, conn, data, priority=False):
+        """Queue an encoded line for conn; returns immediately"""
+        if conn.closed:
+            return  # Offline, e.g. waiting to reconnect
+        if priority:
+            conn.priorityq.append(data)
+        else:
+            conn.sendq.append(data)
+        if not conn.flush_scheduled:
+            conn.flush_scheduled = True
+            self.call_soon(self._flush, conn)
+
+    def close(self, conn):
+        """Flush what we can, then close the connection"""
+        self.call_soon(self._close, conn)
+
+    def pause_reading(self, conn):
+        """Stop reading from conn, still writing and running timers (I/O thread only)"""
+        if conn.read_paused or conn.closed:
+            return
+        conn.read_paused = True
+        self.paused.append(conn)
+        self._update_events(conn)
+
+    def resume_reading(self):
+        """Read from every paused connection again (I/O thread only)"""
+        paused, self.paused = self.paused, []
+        for conn in paused:
+            conn.read_paused = False
+            if not conn.closed:
+                self._update_events(conn)
+
+    def run(self):
+        """Main loop of the I/O thread"""
+        while self.running:
+            self._run_pending()
+            timeout = self._run_timers()
+
+            try:
+                events = self.selector.select(timeout)
+            except OSError as e:
+                print(f"Error in network loop: {e}")
+                continue
+
+            for key, mask in events:
+                conn = key.data
+                if conn is None:
+                    self._drain_wakeup()
+                    continue
+                if conn.closed:
+                    continue
+                # A failure handling one socket takes down that connection, not the loop
+                try:
+                    if key.fileobj is not conn.socket:
+                        self._attempt_ready(conn, key.fileobj)
+                        continue
+
+                    if mask & selectors.EVENT_READ:
+                        self._handle_read(conn)
+                    if mask & selectors.EVENT_WRITE and not conn.closed:
+                        self._handle_write(conn)
+                except Exception as e:
+                    print(f"Error on connection to {conn.server}: {e}")
+                    self._connection_failed(conn, e)
+
+        self.shutdown()
+
+    def _run_pending(self):
+        while self.pending:
+            callback, args = self.pending.popleft()
+            try:
+                callback(*args)
+            except Exception as e:
+                print(f"Error in network callback: {e}")
+
+    def _run_timers(self):
+        """Fire due timers and return the select() timeout until the next one"""
+        timers = self.timers
+        while timers:
+            timer = timers[0]
+            if timer[2] is None:
+                heapq.heappop(timers)
+                continue
+            delay = timer[0] - time.monotonic()
+            if delay > 0:
+                return delay
+            heapq.heappop(timers)
+            try:
+                timer[2](*timer[3])
+            except Exception as e:
+                print(f"Error in network timer: {e}")
+        return None
+
+    def _drain_wakeup(self):
+        try:
+            while self.wakeup_reader.recv(4096):
+                pass
+        except OSError:
+            pass
+
+    def _resolved(self, conn, future):
+        if conn.closed:
+            return
+        try:
+            addresses = future.result()
+        except OSError as e:
+            self._connect_failed(conn, e)
+            return
+
+        conn.addresses = deque(self._interleave(addresses))
+        conn.connect_timer = self.call_later(self.CONNECT_TIMEOUT, self._connect_timed_out, conn)
+        self.irc_client.connection_progress(
+            conn, f"Resolved {conn.server} to {len(conn.addresses)} address(es)"
+        )
+        self._next_attempt(conn)
+
+    @staticmethod
+    def _interleave(addresses):
+        """Alternate address families, keeping the resolver's preferred family first"""
+        families = {}
+        for address in addresses:
+            families.setdefault(address[0], []).append(address)
+        ordered = []
+        queues = [deque(group) for group in families.values()]
+        while queues:
+            for queue in list(queues):
+                ordered.append(queue.popleft())
+                if not queue:
+                    queues.remove(queue)
+        return ordered
+
+    def _next_attempt(self, conn):
+        """Start connecting to the next address while earlier attempts keep racing"""
+        conn.attempt_timer = None
+        if conn.closed or conn.socket is not None:
+            return
+        if not conn.addresses:
+            if not conn.attempts:
+                self._connect_failed(conn, conn.last_error or ConnectionError("No usable address"))
+            return
+
+        family, sock_type, proto, _, address = conn.addresses.popleft()
+        sock = None
+        try:
+            sock = socket.socket(family, sock_type, proto)
+            sock.setblocking(False)
+            error = sock.connect_ex(address)
+            if error not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EAGAIN):
+                raise OSError(error, os.strerror(error))
+        except OSError as e:
+            if sock is not None:
+                sock.close()
+            conn.last_error = e
+            self._next_attempt(conn)
+            return
+
+        conn.attempts.append(sock)
+        self.selector.register(sock, selectors.EVENT_WRITE, conn)
+        self.irc_client.connection_progress(conn, f"Trying {address[0]} port {address[1]}...")
+        conn.attempt_timer = self.call_later(self.ATTEMPT_DELAY, self._next_attempt, conn)
+
+    def _attempt_ready(self, conn, sock):
+        """A connect() finished, either the winner or a failed attempt"""
+        if sock not in conn.attempts:
+            return  # Closed by a winner earlier in the same select() batch
+        self.selector.unregister(sock)
+        conn.attempts.remove(sock)
+        error = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if error:
+            sock.close()
+            conn.last_error = OSError(error, os.strerror(error))
+            if conn.attempt_timer is not None:
+                self.cancel_timer(conn.attempt_timer)
+            self._next_attempt(conn)  # Don't wait out the delay after a failure
+            return
+
+        self._cancel_connect(conn)
+        conn.socket = sock
+        # Let the client queue its registration before anything is flushed
+        self.irc_client.connection_established(conn, sock.getpeername()[0])
+        self._register(conn)
+        conn.heartbeat_timer = self.call_later(conn.heartbeat_interval, self._heartbeat, conn)
+
+    def _heartbeat(self, conn):
+        """Send a timestamped PING, or declare the link dead if the last one went unanswered"""
+        conn.heartbeat_timer = None
+        if conn.closed:
+            return
+        now = time.monotonic()
+        if conn.ping_sent_at is not None:
+            waited = now - conn.ping_sent_at
+            if conn.read_paused:
+                # The PONG may be sitting unread behind the paused data
+                delay = conn.heartbeat_interval
+            elif waited >= conn.lag_threshold:
+                self._connection_failed(conn, TimeoutError(f"No PONG for {waited:.0f}s"))
+                return
+            else:
+                # Still waiting; check again once the threshold is reached
+                delay = min(conn.heartbeat_interval, conn.lag_threshold - waited)
+        else:
+            conn.ping_token = f"IRCurd-{time.monotonic_ns()}"
+            conn.ping_sent_at = now
+            self.send(conn, f"PING :{conn.ping_token}\r\n".encode('ascii'), priority=True)
+            delay = conn.heartbeat_interval
+        conn.heartbeat_timer = self.call_later(delay, self._heartbeat, conn)
+
+    def _cancel_connect(self, conn):
+        """Drop the losing attempts and the connect timers"""
+        for sock in conn.attempts:
+            try:
+                self.selector.unregister(sock)
+            except (KeyError, ValueError):
+                pass
+            sock.close()
+        conn.attempts.clear()
+        conn.addresses.clear()
+        for timer in (conn.attempt_timer, conn.connect_timer):
+            if timer is not None:
+                self.cancel_timer(timer)
+        conn.attempt_timer = conn.connect_timer = None
+
+    def _connect_timed_out(self, conn):
+        conn.connect_timer = None
+        self._connect_failed(conn, TimeoutError("Connection timed out"))
+
+    def _connect_failed(self, conn, error):
+        if conn.closed:
+            return
+        self._cancel_connect(conn)
+        self._forget(conn)
+        self.irc_client.connection_failed(conn, error)
+
+    def _register(self, conn):
+        conn.socket.setblocking(False)
+        conn.buffer = ReceiveBuffer.acquire()
+        self.selector.register(conn.socket, selectors.EVENT_READ, conn)
+        self._handle_write(conn)
+
+    def _flush(self, conn):
+        # Clear the flag before draining so lines queued meanwhile schedule a new flush
+        conn.flush_scheduled = False
+        if not conn.closed and conn.socket is not None:
+            self._handle_write(conn)
+
+    def _close(self, conn):
+        if conn.closed:
+            return
+        if conn.socket is None:
+            self._cancel_connect(conn)  # Still connecting
+            self._forget(conn)
+            return
+        if conn.wireq or conn.priorityq or conn.sendq:
+            # Lines still held back by flood control go too, e.g. a final QUIT or PARTs
+            pending = (b''.join(conn.wireq)[conn.send_offset:] + b''.join(conn.priorityq)
+                       + b''.join(conn.sendq))
+            try:
+                conn.socket.send(pending)  # Best effort
+            except OSError:
+                pass
+        self._forget(conn)
+        try:
+            conn.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        conn.socket.close()
+
+    def _forget(self, conn):
+        conn.closed = True
+        conn.sendq.clear()
+        conn.priorityq.clear()
+        conn.wireq.clear()
+        conn.send_offset = 0
+        for timer in (conn.throttle_timer, conn.heartbeat_timer):
+            if timer is not None:
+                self.cancel_timer(timer)
+        conn.throttle_timer = conn.heartbeat_timer = None
+        if conn.buffer is not None:
+            conn.buffer.release()
+            conn.buffer = None
+        if conn.socket is None:
+            return
+        try:
+            self.selector.unregister(conn.socket)
+        except (KeyError, ValueError):
+            pass
+
+    def _handle_read(self, conn):
+        try:
+            received = conn.buffer.recv_from(conn.socket)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as e:
+            self._connection_failed(conn, e)
+            return
+
+        if not received:
+            self._connection_failed(conn, ConnectionError("Server closed connection"))
+            return
+
+        # Lines are framed in place at the byte level, so multibyte characters
+        # split across reads are decoded only once the whole line has arrived
+        raw = conn.buffer.complete()
+        if raw is None:
+            return
+        # Every complete line of this read is delivered, even if the client
+        # pauses reading meanwhile; that only holds back the next read
+        for line in conn.decode_lines(raw):
+            if line:
+                self.irc_client.receive_line(line, conn)
+                if conn.closed:
+                    return
+
+    def _admit(self, conn):
+        """Move lines onto the wire queue: priority lines first, bulk lines as tokens allow"""
+        wireq = conn.wireq
+        now = time.monotonic()
+        while conn.priorityq:
+            wireq.append(conn.priorityq.popleft())
+            conn.bucket.charge(now)
+
+        # Bulk lines are only admitted once the wire is idle, so priority
+        # lines queued later never wait behind them
+        sendq = conn.sendq
+        if wireq or not sendq:
+            return
+        while sendq and conn.bucket.consume(now):
+            wireq.append(sendq.popleft())
+        if wireq and conn.throttled_since is not None:
+            conn.throttled_time += now - conn.throttled_since
+            conn.throttled_since = None
+
+        if sendq:
+            if conn.throttled_since is None:
+                conn.throttled_since = now
+            if conn.throttle_timer is None:
+                conn.throttle_timer = self.call_later(conn.bucket.delay(), self._throttle_expired, conn)
+
+    def _throttle_expired(self, conn):
+        conn.throttle_timer = None
+        if not conn.closed and conn.socket is not None:
+            self._handle_write(conn)
+
+    def _handle_write(self, conn):
+        wireq = conn.wireq
+        self._admit(conn)
+        while wireq:
+            # Coalesce the admitted lines into one scatter-gather write
+            buffers = [memoryview(wireq[0])[conn.send_offset:]]
+            size = len(buffers[0])
+            for data in islice(wireq, 1, None):
+                if size + len(data) > conn.write_budget:
+                    break
+                buffers.append(data)
+                size += len(data)
+
+            try:
+                sent = self._write(conn.socket, buffers)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError as e:
+                self._connection_failed(conn, e)
+                return
+
+            # Drop fully written lines, remember how far into the next one we got
+            remaining = conn.send_offset + sent
+            while wireq and remaining >= len(wireq[0]):
+                remaining -= len(wireq.popleft())
+            conn.send_offset = remaining
+            if sent < size:
+                break  # Partial write, resume from send_offset once writable
+            if not wireq:
+                self._admit(conn)
+        self._update_events(conn)
+
+    def _update_events(self, conn):
+        """Watch conn for reads unless paused, and for writes while lines wait"""
+        if conn.buffer is None:
+            return  # Not registered yet, _register() picks up the pending data
+        events = 0 if conn.read_paused else selectors.EVENT_READ
+        if conn.wireq:
+            events |= selectors.EVENT_WRITE
+        selector = self.selector
+        try:
+            current = selector.get_key(conn.socket).events
+        except KeyError:
+            current = 0  # Paused with nothing to write
+        if events == current:
+            return
+        if not events:
+            selector.unregister(conn.socket)
+        elif not current:
+            selector.register(conn.socket, events, conn)
+        else:
+            selector.modify(conn.socket, events, conn)
+
+    def _write(self, sock, buffers):
+        if len(buffers) == 1:
+            return sock.send(buffers[0])
+        if hasattr(sock, 'sendmsg'):
+            return sock.sendmsg(buffers)
+        return sock.send(b''.join(buffers))  # No sendmsg on Windows
+
+    def _connection_failed(self, conn, error):
+        if conn.closed:
+            return
+        if conn.socket is None:
+            self._connect_failed(conn, error)  # Still connecting
+            return
+        self._forget(conn)
+        try:
+            conn.socket.close()
+        except OSError:
+            pass
+        self.irc_client.connection_lost(conn, error)
+
+    def shutdown(self):
+        """Close every connection and release the selector, wakeup pair and resolver"""
+        # Run by the I/O thread on its way out, or directly for an engine never started
+        self._run_pending()
+        conns = [key.data for key in self.selector.get_map().values() if key.data is not None]
+        for conn in conns + self.paused:  # Paused and idle connections aren't registered
+            self._close(conn)
+        self.selector.close()
+        self.wakeup_reader.close()
+        self.wakeup_writer.close()
+        self.resolver.shutdown(wait=False)
+
 
 class IRCClient:
+    RECONNECT_BASE_DELAY = 2     # Seconds before the first reconnect attempt
+    RECONNECT_MAX_DELAY = 300    # Upper bound for the exponential backoff
+    JOIN_BATCH_LENGTH = 500      # Max length of the channel list in one JOIN line
+    EVENT_QUEUE_SIZE = 10000     # Events waiting for the Tk thread before reading from servers pauses
+    EVENT_TICK = 10              # ms between drains of the event queue when it is idle
+    EVENT_FRAME_BUDGET = 0.02    # Seconds of event handling per drain before Tk gets to redraw
+    NICK_ATTEMPTS = 5            # Alternate nicks tried when ours is taken while registering
+
     def __init__(self, default_server, default_port, default_nickname):
         self.connections = {}  # Dictionary to store server connections
         self.default_nickname = default_nickname
-        self.channel_windows = {}
-        self.private_windows = {}
+        self.channels = {}  # (server, folded channel) -> Channel, with or without a window
+        self.private_windows = {}  # (server, folded nick) -> PrivateWindow
+        self.default_isupport = ISupport()  # Casemapping for servers we aren't connected to
         self.server_nodes = {}
-        self.lock = threading.Lock()
+        self.tree_servers = {}  # Server node id -> server name
+        self.tree_windows = {}  # Channel/PM node id -> (server, name)
+        self.pending_bans = {}  # Nick -> host ban options (channel, reason, kick), waiting for WHOIS
+        self.handlers = {}  # Command or numeric -> list of handler(msg, server)
+        self.register_builtin_handlers()
         self.running = True
         self.current_server = None
         self.disconnecting = False
-        
-        # Create GUI
-        self.create_status_window()
+
+        # Tk may only be touched from the thread that created it; everything
+        # the network thread wants shown goes through this queue
+        self.gui_thread = threading.get_ident()
+        self.events = queue.Queue()
+        self.reading_paused = False  # Set by the network thread once a server's reads are paused
+        self.dirty_windows = set()  # Windows with text rendered since the last frame
+        self.status_buffer = []     # Status lines waiting for the next frame
+
+        # Single I/O thread shared by every server connection
+        self.engine = NetworkEngine(self)
+        self.engine.start()
         
         self.preferences = {
-            'theme': 'default'
+            'theme': 'default',
+            'encoding': 'utf-8',
+            'fallback_encoding': 'latin-1',  # Used for lines that aren't valid in 'encoding'
+            'flood_burst': 5,    # Lines sent back to back before throttling
+            'flood_rate': 0.5,   # Lines per second once the burst is used up
+            'write_budget': 4096,  # Bytes of queued lines coalesced into one write
+            'heartbeat_interval': 30,  # Seconds between client PINGs
+            'lag_threshold': 90,       # Seconds without a PONG before reconnecting
+            'handler_timing': True,    # Time every message handler for /stats handlers
+            'slow_line_budget': 0.05,  # Seconds one line may take before a warning is logged
+            'scrollback_lines': 5000,  # Lines kept in a chat window, older ones spill to disk
+            'scrollback_page': 500,    # Lines paged back in per scroll to the top
+            'channel_backlog': 500     # Lines a channel keeps for when its window is first opened
         }
+        self.handler_stats = HandlerStats(
+            self.preferences['handler_timing'],
+            self.preferences['slow_line_budget']
+        )
+        self.flood_settings = {}  # Per-server (burst, rate) overrides
+
+        # Create GUI, once the preferences it reads are in place
+        self.create_status_window()
+        self.status_window.after(self.EVENT_TICK, self.drain_events)
         #self.connect_to_server(default_server, default_port, default_nickname)
         
     def save_theme_preference(self, theme_name):
@@ -952,13 +2359,8 @@ class IRCClient:
                 # Send QUIT command to server
                 self.send_command(f"QUIT :{quit_message}", server)
                 
-                # Close socket
-                try:
-                    self.connections[server]['socket'].shutdown(socket.SHUT_RDWR)
-                    self.connections[server]['socket'].close()
-                except:
-                    pass
-                del self.connections[server]
+                # Close socket once the QUIT has been flushed
+                self.engine.close(self.connections.pop(server))
                 
                 # Remove server node and cleanup windows
                 self.remove_server_node(server)
@@ -971,28 +2373,18 @@ class IRCClient:
     def remove_server_node(self, server):
         """Remove a server node and all its children from the tree"""
         if server in self.server_nodes:
-            # Delete all channel windows for this server
-            channels_to_remove = []
-            for channel_key in self.channel_windows.keys():
-                if channel_key.startswith(f"{server}:"):
-                    channels_to_remove.append(channel_key)
-            
-            for channel_key in channels_to_remove:
-                self.channel_windows[channel_key].window.destroy()
-                del self.channel_windows[channel_key]
-
-            # Delete all PM windows for this server
-            pms_to_remove = []
-            for username, window in self.private_windows.items():
-                if window.server == server:
-                    pms_to_remove.append(username)
-            
-            for username in pms_to_remove:
-                self.private_windows[username].window.destroy()
-                del self.private_windows[username]
+            # Delete all channels and PM windows for this server
+            for key in [key for key in self.channels if key[0] == server]:
+                self.channels.pop(key).close_view()
+            for key in [key for key in self.private_windows if key[0] == server]:
+                self.private_windows.pop(key).window.destroy()
 
             # Remove from tree and clean up server_nodes
+            server_data = self.server_nodes[server]
+            for node in list(server_data['channels'].values()) + list(server_data['private_msgs'].values()):
+                self.tree_windows.pop(node, None)
             self.network_tree.delete(self.server_nodes[server]['node'])
+            del self.tree_servers[self.server_nodes[server]['node']]
             del self.server_nodes[server]
             
             if server == self.current_server:
@@ -1016,30 +2408,44 @@ class IRCClient:
                 'channels': {},
                 'private_msgs': {}
             }
+            self.tree_servers[server_node] = server
             self.current_server = server
             print(f"Added server node with icon: {server}")  # Debug print
             return server_node
 
-    def add_channel_node(self, channel):
-        """Add a channel under the current server"""
-        if self.current_server and self.current_server in self.server_nodes:
-            server_data = self.server_nodes[self.current_server]
-            if channel not in server_data['channels']:
+    def update_server_lag(self, server):
+        """Show the measured lag next to the server in the network tree"""
+        conn = self.connections.get(server)
+        if server in self.server_nodes and conn is not None and conn.lag is not None:
+            self.network_tree.item(
+                self.server_nodes[server]['node'],
+                text=f"{server} ({conn.lag * 1000:.0f} ms)"
+            )
+
+    def add_channel_node(self, channel, server=None):
+        """Add a channel under its server (the current one by default)"""
+        server = server or self.current_server
+        if server in self.server_nodes:
+            server_data = self.server_nodes[server]
+            folded = self.window_key(server, channel)[1]
+            if folded not in server_data['channels']:
                 channel_node = self.network_tree.insert(
                     server_data['node'], 'end',
                     text=channel,
                     tags=('channel',),
                     image=self.channel_icon
                 )
-                server_data['channels'][channel] = channel_node
+                server_data['channels'][folded] = channel_node
+                self.tree_windows[channel_node] = (server, channel)
                 print(f"Added channel node with icon: {channel}")  # Debug print
 
     def add_pm_node(self, username, server):
         """Add a private message node to the correct server in the tree"""
         if server in self.server_nodes:
             server_data = self.server_nodes[server]
-            if 'private_msgs' not in server_data:
-                server_data['private_msgs'] = {}
+            folded = self.window_key(server, username)[1]
+            if folded in server_data['private_msgs']:
+                return
             
             pm_text = f" PM: {username}"
             pm_id = self.network_tree.insert(
@@ -1049,43 +2455,57 @@ class IRCClient:
                 tags=('pm',),
                 image=self.pm_icon
             )
-            server_data['private_msgs'][username] = pm_id
+            server_data['private_msgs'][folded] = pm_id
+            self.tree_windows[pm_id] = (server, username)
             print(f"Added PM node with icon: {username}")  # Debug print
 
-    def remove_channel_node(self, channel):
+    def remove_channel_node(self, channel, server=None):
         """Remove a channel node"""
-        if self.current_server and self.current_server in self.server_nodes:
-            server_data = self.server_nodes[self.current_server]
-            if channel in server_data['channels']:
-                self.network_tree.delete(server_data['channels'][channel])
-                del server_data['channels'][channel]
+        server = server or self.current_server
+        if server in self.server_nodes:
+            node = self.server_nodes[server]['channels'].pop(self.window_key(server, channel)[1], None)
+            if node is not None:
+                self.network_tree.delete(node)
+                self.tree_windows.pop(node, None)
 
-    def remove_pm_node(self, username):
+    def remove_pm_node(self, username, server=None):
         """Remove a private message node"""
-        if self.current_server and self.current_server in self.server_nodes:
-            server_data = self.server_nodes[self.current_server]
-            if username in server_data['private_msgs']:
-                self.network_tree.delete(server_data['private_msgs'][username])
-                del server_data['private_msgs'][username]
+        server = server or self.current_server
+        if server in self.server_nodes:
+            node = self.server_nodes[server]['private_msgs'].pop(self.window_key(server, username)[1], None)
+            if node is not None:
+                self.network_tree.delete(node)
+                self.tree_windows.pop(node, None)
+
+    def window_key(self, server, name):
+        """Key of a channel or private window: (server, name folded by the server's casemapping)"""
+        conn = self.connections.get(server)
+        isupport = conn.isupport if conn is not None else self.default_isupport
+        return (server, isupport.fold(name))
+
+    def rekey_windows(self, server):
+        """Fold a server's window keys again after its CASEMAPPING changed"""
+        for windows, name in ((self.channels, 'channel_name'), (self.private_windows, 'username')):
+            for key in [key for key in windows if key[0] == server]:
+                window = windows.pop(key)
+                windows[self.window_key(server, getattr(window, name))] = window
+        server_data = self.server_nodes.get(server)
+        if server_data:
+            for section in ('channels', 'private_msgs'):
+                server_data[section] = {
+                    self.window_key(*self.tree_windows[node])[1]: node
+                    for node in server_data[section].values()
+                }
 
     def toggle_window_from_tree(self, event):
         """Handle double-click on tree items"""
         item = self.network_tree.selection()[0]
-        item_tags = self.network_tree.item(item)['tags']
-        item_text = self.network_tree.item(item)['text']
-
-        if 'channel' in item_tags:
-            # Get the server from the parent item
-            parent = self.network_tree.parent(item)
-            server = self.network_tree.item(parent)['text']
-            channel_key = f"{server}:{item_text}"
-            
-            if channel_key in self.channel_windows:
-                self.channel_windows[channel_key].toggle_visibility()
-        elif 'pm' in item_tags:
-            username = item_text.replace('PM: ', '')
-            if username in self.private_windows:
-                self.private_windows[username].toggle_visibility()
+        if item not in self.tree_windows:
+            return  # A server node
+        key = self.window_key(*self.tree_windows[item])
+        window = self.channels.get(key) or self.private_windows.get(key)
+        if window is not None:
+            window.toggle_visibility()
 
     def send_ctcp_request(self, target, request):
         """Send a CTCP request"""
@@ -1116,8 +2536,8 @@ class IRCClient:
             self.send_ctcp_reply(sender, f"CLIENTINFO {supported_commands}")
         elif ctcp_command == 'ACTION':
             # Handle /me actions
-            if target in self.channel_windows:
-                self.channel_windows[target].add_action(sender, params)
+            if target in self.channels:
+                self.channels[target].add_action(sender, params)
             elif target == self.nickname and sender in self.private_windows:
                 self.private_windows[sender].add_action(sender, params)
 
@@ -1127,20 +2547,17 @@ class IRCClient:
         if server is None:
             server = self.current_server
             
-        # Create a unique key for the private window
-        pm_key = f"{server}:{username}"
-        
-        if username not in self.private_windows:
-            self.private_windows[username] = PrivateWindow(self, username, server)
-            # Only add to tree if it doesn't exist
-            server_data = self.server_nodes.get(server)
-            if server_data and username not in server_data.get('private_msgs', {}):
-                self.add_pm_node(username, server)
+        # Private windows are per server, so the same nick on two networks doesn't collide
+        pm_key = self.window_key(server, username)
+        
+        if pm_key not in self.private_windows:
+            # The window adds its own node to the tree
+            self.private_windows[pm_key] = PrivateWindow(self, username, server)
             self.add_status_message(f"Started private chat with {username} on {server}")
         else:
             # If window exists, just show it
-            self.private_windows[username].window.deiconify()
-            self.private_windows[username].window.lift()
+            self.private_windows[pm_key].window.deiconify()
+            self.private_windows[pm_key].window.lift()
 
 
 
@@ -1149,11 +2566,11 @@ class IRCClient:
         
         
     def create_channel_window(self, channel, server):
-        """Create a new channel window"""
-        channel_key = f"{server}:{channel}"
-        if channel_key not in self.channel_windows:
-            self.channel_windows[channel_key] = ChannelWindow(self, channel, server)
-            self.add_channel_node(channel)  # Add to tree
+        """Track a joined channel; its window is built when opened from the tree"""
+        channel_key = self.window_key(server, channel)
+        if channel_key not in self.channels:
+            self.channels[channel_key] = Channel(self, channel, server)
+            self.add_channel_node(channel, server)  # Add to tree
             self.send_command(f"NAMES {channel}", server)
             self.add_status_message(f"Joined channel: {channel} on {server}")
 
@@ -1295,6 +2712,11 @@ class IRCClient:
         # Create status display
         self.status_display = scrolledtext.ScrolledText(self.right_frame, wrap=tk.WORD)
         self.status_display.pack(fill=tk.BOTH, expand=True)
+        self.scrollback = Scrollback(
+            self.status_display,
+            self.preferences['scrollback_lines'],
+            self.preferences['scrollback_page']
+        )
         
         # Create input frame
         self.input_frame = ttk.Frame(self.right_frame)
@@ -1444,7 +2866,7 @@ class IRCClient:
         # Current connection info
         ttk.Label(general_frame, text="Current Connection", font=("", 10, "bold")).pack(pady=10)
         ttk.Label(general_frame, text=f"Server: {self.current_server}").pack(pady=2)
-        ttk.Label(general_frame, text=f"Nickname: {self.connections[self.current_server]['nickname']}").pack(pady=2)
+        ttk.Label(general_frame, text=f"Nickname: {self.connections[self.current_server].nickname}").pack(pady=2)
 
         # Nickname change frame
         nick_frame = ttk.LabelFrame(general_frame, text="Change Nickname")
@@ -1491,8 +2913,8 @@ class IRCClient:
 
         # Add current channels
         if self.current_server in self.server_nodes:
-            for channel in self.server_nodes[self.current_server]['channels'].keys():
-                channels_list.insert(tk.END, channel)
+            for node in self.server_nodes[self.current_server]['channels'].values():
+                channels_list.insert(tk.END, self.tree_windows[node][1])
 
         # Buttons frame
         buttons_frame = ttk.Frame(channel_frame)
@@ -1501,7 +2923,8 @@ class IRCClient:
         def add_channel():
             channel = channel_entry.get().strip()
             if channel:
-                if not channel.startswith('#'):
+                conn = self.connections.get(self.current_server)
+                if not (conn.isupport.is_channel(channel) if conn else channel[0] == '#'):
                     channel = '#' + channel
                 if channel not in channels_list.get(0, tk.END):
                     channels_list.insert(tk.END, channel)
@@ -1550,16 +2973,17 @@ class IRCClient:
             server = server_var.get()
             channel = channel_entry.get().strip()
             if server and channel:
-                if channel[0] != '#':
+                conn = self.connections.get(server)
+                if not (conn.isupport.is_channel(channel) if conn else channel[0] == '#'):
                     channel = '#' + channel
                 join_window.destroy()
                 # Set current server before joining
                 self.current_server = server
-                # Create channel window and add to tree
-                channel_key = f"{server}:{channel}"
-                if channel_key not in self.channel_windows:
-                    self.channel_windows[channel_key] = ChannelWindow(self, channel, server)
-                    self.add_channel_node(channel)  # Add to tree
+                # Track the channel and add it to the tree
+                channel_key = self.window_key(server, channel)
+                if channel_key not in self.channels:
+                    self.channels[channel_key] = Channel(self, channel, server)
+                    self.add_channel_node(channel, server)  # Add to tree
                 # Send join command
                 self.send_command(f"JOIN {channel}", server)
             else:
@@ -1667,11 +3091,11 @@ class IRCClient:
                 channel = channels_list.get(selection[0]).split()[0]  # Get just the channel name
                 # Set current server before joining
                 self.current_server = self.current_server
-                # Create channel window and add to tree
-                channel_key = f"{self.current_server}:{channel}"
-                if channel_key not in self.channel_windows:
-                    self.channel_windows[channel_key] = ChannelWindow(self, channel, self.current_server)
-                    self.add_channel_node(channel)  # Add to tree
+                # Track the channel and add it to the tree
+                channel_key = self.window_key(self.current_server, channel)
+                if channel_key not in self.channels:
+                    self.channels[channel_key] = Channel(self, channel, self.current_server)
+                    self.add_channel_node(channel, self.current_server)  # Add to tree
                 # Send join command
                 self.send_command(f"JOIN {channel}", self.current_server)
         
@@ -1724,26 +3148,21 @@ class IRCClient:
         """Safely disconnect from a server"""
         try:
             self.disconnecting = True
-            with self.lock:
-                if server in self.connections:
-                    # Close all channel windows for this server
-                    channels_to_close = [
-                        key for key in self.channel_windows.keys()
-                        if key.startswith(f"{server}:")
-                    ]
-                    for channel_key in channels_to_close:
-                        if channel_key in self.channel_windows:
-                            self.channel_windows[channel_key].on_closing()
-                    
-                    # Close the socket
-                    try:
-                        self.connections[server]['socket'].close()
-                    except:
-                        pass
-                    del self.connections[server]
-                    
-                    # Use the dedicated method to remove server node and all its children
-                    self.remove_server_node(server)
+            if server in self.connections:
+                # Close all channel windows for this server
+                channels_to_close = [
+                    key for key in self.channels.keys()
+                    if key[0] == server
+                ]
+                for channel_key in channels_to_close:
+                    if channel_key in self.channels:
+                        self.channels[channel_key].part()
+                
+                # Close the socket
+                self.engine.close(self.connections.pop(server))
+                
+                # Use the dedicated method to remove server node and all its children
+                self.remove_server_node(server)
         finally:
             self.disconnecting = False
 
@@ -1791,8 +3210,8 @@ class IRCClient:
             
         # Check if it's a channel with server prefix
         if ':' in window_name:
-            if window_name in self.channel_windows:
-                self.channel_windows[window_name].toggle_visibility()
+            if window_name in self.channels:
+                self.channels[window_name].toggle_visibility()
         else:
             # Handle private messages
             if window_name in self.private_windows:
@@ -1808,12 +3227,14 @@ class IRCClient:
                 self.handle_command(command, None)
             self.command_input.delete(0, tk.END)
             
-    def send_command(self, command, server=None):
+    def send_command(self, command, server=None, priority=False):
         """Send command to specified server or current server"""
+        # Priority commands (PONG, operator actions) skip the flood control queue
         if server is None:
             server = self.current_server
-        if server in self.connections:
-            self.connections[server]['socket'].send(f"{command}\r\n".encode('utf-8'))
+        conn = self.connections.get(server)
+        if conn is not None:
+            self.engine.send(conn, f"{command}\r\n".encode('utf-8'), priority)
 
         
     def send_channel_message(self, channel, message):
@@ -1861,11 +3282,11 @@ class IRCClient:
 
         elif cmd == '/part':
             if current_channel:
-                channel_key = f"{self.current_server}:{current_channel}"
-                if channel_key in self.channel_windows:
+                channel_key = self.window_key(self.current_server, current_channel)
+                if channel_key in self.channels:
                     self.send_command(f"PART {current_channel}", self.current_server)
-                    self.channel_windows[channel_key].window.destroy()
-                    del self.channel_windows[channel_key]
+                    self.channels[channel_key].close_view()
+                    del self.channels[channel_key]
 
         if cmd == '/server':
             if len(parts) >= 2:
@@ -1881,11 +3302,11 @@ class IRCClient:
         elif cmd == '/me':
                 if len(parts) > 1 and current_channel:
                     action_text = ' '.join(parts[1:])
-                    channel_key = f"{self.current_server}:{current_channel}"
+                    channel_key = self.window_key(self.current_server, current_channel)
                     self.send_ctcp_request(current_channel, f"ACTION {action_text}", self.current_server)
-                    if channel_key in self.channel_windows:
-                        self.channel_windows[channel_key].add_action(
-                            self.connections[self.current_server]['nickname'], 
+                    if channel_key in self.channels:
+                        self.channels[channel_key].add_action(
+                            self.connections[self.current_server].nickname, 
                             action_text
                         )
 
@@ -1898,6 +3319,44 @@ class IRCClient:
             self.send_command("LIST")
 
 
+        elif cmd == '/stats':
+            what = parts[1].lower() if len(parts) > 1 else None
+            if what == 'queue':
+                self.show_queue_stats()
+            elif what == 'lag':
+                self.show_lag_stats()
+            elif what == 'users':
+                self.show_users_list_stats()
+            elif what == 'handlers':
+                option = parts[2].lower() if len(parts) > 2 else None
+                if option in ('on', 'off'):
+                    self.handler_stats.enabled = self.preferences['handler_timing'] = option == 'on'
+                    self.add_status_message(f"Handler timing {option}")
+                elif option == 'reset':
+                    self.handler_stats.reset()
+                    self.add_status_message("Handler statistics cleared")
+                else:
+                    self.show_handler_stats()
+            else:
+                self.add_status_message("Usage: /stats queue|lag|users|handlers [on|off|reset]")
+
+        elif cmd == '/flood':
+            try:
+                burst = int(parts[1])
+                rate = float(parts[2])
+                server = parts[3] if len(parts) > 3 else self.current_server
+                if burst < 1 or rate <= 0:
+                    raise ValueError
+            except (IndexError, ValueError):
+                self.add_status_message("Usage: /flood <burst> <lines per second> [server]")
+                return
+            self.flood_settings[server] = (burst, rate)
+            if server in self.connections:
+                bucket = self.connections[server].bucket
+                bucket.burst = burst
+                bucket.rate = rate
+            self.add_status_message(f"Flood control for {server}: burst {burst}, {rate} lines/s")
+
         elif cmd == '/nickserv' or cmd == '/ns':
             if len(parts) > 1:
                 nickserv_command = ' '.join(parts[1:])  # Join all remaining parts
@@ -1912,440 +3371,553 @@ class IRCClient:
             else:
                 self.add_status_message("Usage: /chanserv identify <password>")
                 
+    def show_queue_stats(self):
+        """Print outbound queue depth and flood control statistics per server"""
+        if not self.connections:
+            self.add_status_message("No active connections")
+            return
+        now = time.monotonic()
+        for server, conn in list(self.connections.items()):
+            throttled = conn.throttled_time
+            if conn.throttled_since is not None:
+                throttled += now - conn.throttled_since
+            self.add_status_message(
+                f"{server}: {len(conn.sendq)} queued, {len(conn.priorityq)} priority, "
+                f"throttled {throttled:.1f}s "
+                f"(burst {conn.bucket.burst}, {conn.bucket.rate} lines/s)"
+            )
+
+    def show_handler_stats(self):
+        """Print the most expensive message handlers by total and p99 time"""
+        stats = self.handler_stats
+        if not stats.handlers:
+            state = "no samples yet" if stats.enabled else "timing is off (/stats handlers on)"
+            self.add_status_message(f"Handler statistics: {state}")
+            return
+        by_total, by_p99 = stats.summary()
+        for title, rows in (("Top handlers by total time", by_total), ("Top handlers by p99", by_p99)):
+            self.add_status_message(f"{title}:")
+            for name, calls, total, p99, worst in rows:
+                self.add_status_message(
+                    f"  {name}: {calls} calls, total {total / 1e6:.1f} ms, "
+                    f"avg {total / calls / 1e3:.0f} us, p99 <{p99 / 1e3:.0f} us, max {worst / 1e3:.0f} us"
+                )
+        self.add_status_message(
+            f"Lines over the {stats.budget_ns / 1e6:.0f} ms budget: {stats.slow_lines}"
+        )
+
+    def show_users_list_stats(self):
+        """Print how many user list changes each channel folded into shared refreshes"""
+        if not self.channels:
+            self.add_status_message("No open channels")
+            return
+        for chan in list(self.channels.values()):
+            self.add_status_message(
+                f"{chan.channel_name} ({chan.server}): {len(chan.members)} users, "
+                f"{chan.users_refreshes} list refreshes, {chan.coalesced_updates} changes coalesced"
+            )
+
+    def show_lag_stats(self):
+        """Print the last measured heartbeat lag per server"""
+        if not self.connections:
+            self.add_status_message("No active connections")
+            return
+        for server, conn in list(self.connections.items()):
+            lag = "not measured yet" if conn.lag is None else f"{conn.lag * 1000:.0f} ms"
+            self.add_status_message(f"{server}: lag {lag}")
+
     def add_status_message(self, message):
+        if not self.on_gui_thread():
+            self.post_event(self.add_status_message, message)
+            return
         timestamp = datetime.now().strftime("[%H:%M:%S]")
-        self.status_display.insert(tk.END, f"{timestamp} {message}\n")
-        self.status_display.see(tk.END)
+        # Status lines are batched like chat lines, see flush_render()
+        if not self.status_buffer:
+            self.dirty_windows.add(self)
+        self.status_buffer.append(f"{timestamp} {message}\n")
+
+    def flush_render(self):
+        """Insert the status lines of this frame in one call"""
+        lines, self.status_buffer = self.status_buffer, []
+        if lines:
+            self.scrollback.insert(''.join(lines))
         
     
-    def handle_server_message(self, data, server):
+    def register_handler(self, command, handler):
+        """Subscribe handler(msg, server) to a command or numeric"""
+        self.handlers.setdefault(command.upper(), []).append(handler)
+
+    def unregister_handler(self, command, handler):
+        """Remove a handler added with register_handler"""
+        handlers = self.handlers.get(command.upper())
+        if handlers and handler in handlers:
+            handlers.remove(handler)
+            if not handlers:
+                del self.handlers[command.upper()]
+
+    def register_builtin_handlers(self):
+        """Hook the client's own handlers into the dispatch table"""
+        for command, handler in (
+            ('ERROR', self.handle_error),
+            ('PING', self.handle_ping),
+            ('001', self.handle_welcome),
+            ('433', self.handle_nick_in_use),
+            ('005', self.handle_isupport),
+            ('MODE', self.handle_mode),
+            ('324', self.handle_channel_modes),
+            ('TOPIC', self.handle_topic),
+            ('332', self.handle_topic),
+            ('311', self.handle_whois_user),
+            ('318', self.handle_whois_end),
+            ('322', self.handle_list),
+            ('323', self.handle_list_end),
+            ('JOIN', self.handle_join),
+            ('353', self.handle_names),
+            ('366', self.handle_names_end),
+            ('PRIVMSG', self.handle_privmsg),
+            ('PART', self.handle_part),
+            ('KICK', self.handle_kick),
+            ('QUIT', self.handle_quit),
+            ('NICK', self.handle_nick),
+        ):
+            self.register_handler(command, handler)
+
+    def on_gui_thread(self):
+        return threading.get_ident() == self.gui_thread
+
+    def post_event(self, callback, *args):
+        """Run callback(*args) on the Tk thread"""
+        if self.on_gui_thread():
+            callback(*args)
+            return
+        self.events.put((callback, args))
+
+    def drain_events(self):
+        """Run queued events on the Tk thread, yielding once the frame budget is spent"""
+        deadline = time.perf_counter() + self.EVENT_FRAME_BUDGET
+        events = self.events
         try:
-            if data.startswith('ERROR :') or 'Connection closed' in data:
-                error_msg = data.split(':', 1)[1].strip()
-                self.add_status_message(f"Server {server} disconnected: {error_msg}")
-                self.quit_server(server)
-                self.remove_server_node(server)  # Add this line
-                return
+            while True:
+                callback, args = events.get_nowait()
+                try:
+                    callback(*args)
+                except Exception as e:
+                    print(f"Error in event {getattr(callback, '__name__', callback)}: {e}")
+                if time.perf_counter() >= deadline:
+                    break
+        except queue.Empty:
+            pass
+        # One insert and one scroll per window for everything shown this frame
+        while self.dirty_windows:
+            self.dirty_windows.pop().flush_render()
+        # Paused servers are read again once the backlog is down to half
+        if self.reading_paused and events.qsize() < self.EVENT_QUEUE_SIZE // 2:
+            self.reading_paused = False
+            self.engine.call_soon(self.engine.resume_reading)
+        if self.running:
+            # Come straight back when the budget ran out with events left
+            self.status_window.after(1 if events.qsize() else self.EVENT_TICK, self.drain_events)
+
+    def receive_line(self, line, conn):
+        """Parse a line on the network thread and hand it to the Tk thread"""
+        try:
+            msg = Message.parse(line)
+        except Exception as e:
+            self.add_status_message(f"Error parsing server message: {e}")
+            return
+        # Keepalives are answered here so a busy GUI can't time the link out
+        if msg.command == 'PING':
+            self.engine.send(conn, f"PONG :{msg.trailing}\r\n".encode('utf-8'), priority=True)
+        elif msg.command == 'PONG' and conn.heartbeat_reply(msg.trailing):
+            self.post_event(self.update_server_lag, conn.server)
+        self.post_event(self.dispatch_message, msg, line, conn.server)
+        if self.events.qsize() >= self.EVENT_QUEUE_SIZE:
+            # Stop reading from this server until the GUI catches up; the
+            # network thread keeps writing and running timers for every server
+            self.engine.pause_reading(conn)
+            self.reading_paused = True
+
+    def dispatch_message(self, msg, data, server):
+        """Run every handler registered for msg's command (Tk thread)"""
+        if msg.command != 'ERROR':
             # Print raw data to status window for debugging
             self.add_status_message(f"DEBUG: {data}")
-            
-            if data.startswith('PING'):
-                ping_param = data.split(':', 1)[1] if ':' in data else data.split('PING', 1)[1]
-                self.send_command(f'PONG :{ping_param.strip()}', server)
-                self.add_status_message(f"PONG sent to {server}")
-                return
-            elif data.startswith('PONG'):
-                return
-            
 
-            elif 'MODE' in data:
-                try:
-                    parts = data.split()
-                    if len(parts) >= 4:
-                        setter = parts[0].split('!')[0].lstrip(':')
-                        channel = parts[2]
-                        mode = parts[3]
-                        target = parts[4] if len(parts) > 4 else None
-                        
-                        channel_key = f"{server}:{channel}"
-                        if channel_key in self.channel_windows:
-                            window = self.channel_windows[channel_key]
-                            
-                            if target:
-                                # Handle user modes
-                                if '+o' in mode:
-                                    # Add @ to user in list
-                                    window.users.discard(target)
-                                    window.users.add(f"@{target}")
-                                    window.update_users_list()
-                                    window.add_action(setter, f"gives channel operator status to {target}")
-                                    
-                                elif '-o' in mode:
-                                    # Remove @ from user
-                                    window.users.discard(f"@{target}")
-                                    window.users.add(target)
-                                    window.update_users_list()
-                                    window.add_action(setter, f"removes channel operator status from {target}")
-                                    
-                                elif '+v' in mode:
-                                    # Add + to user
-                                    window.users.discard(target)
-                                    window.users.add(f"+{target}")
-                                    window.update_users_list()
-                                    window.add_action(setter, f"gives voice to {target}")
-                                    
-                                elif '-v' in mode:
-                                    # Remove + from user
-                                    window.users.discard(f"+{target}")
-                                    window.users.add(target)
-                                    window.update_users_list()
-                                    window.add_action(setter, f"removes voice from {target}")
-                                    
-                            print(f"DEBUG - Mode change: {setter} sets {mode} on {channel} for {target}")
-                            
-                except Exception as e:
-                    print(f"Error handling mode: {e}")
-                    self.add_status_message(f"Error handling mode: {e}")
-                            
-                except Exception as e:
-                    print(f"Error handling mode: {e}")
-                    self.add_status_message(f"Error handling mode: {e}")
+        stats = self.handler_stats if self.handler_stats.enabled else None
+        if stats:
+            line_start = started = perf_counter_ns()
 
-            elif data.startswith(':') and ('311' in data or '318' in data):  # WHOIS response
-                try:
-                    parts = data.split()
-                    target_nick = parts[3]
-                    
-                    if '311' in data:  # WHOIS user info
-                        user_host = parts[4] + '@' + parts[5]
-                        if target_nick in self.pending_bans:
-                            channel = self.pending_bans[target_nick]
-                            ban_mask = f'*!{user_host}'
-                            self.send_command(f'MODE {channel} +b {ban_mask}', server)
-                            self.send_command(f'KICK {channel} {target_nick} Banned', server)
-                            del self.pending_bans[target_nick]
-                            
-                    elif '318' in data:  # End of WHOIS
-                        if target_nick in self.pending_bans:
-                            del self.pending_bans[target_nick]
-                            
-                except Exception as e:
-                    self.add_status_message(f"Error handling WHOIS for ban: {e}")
+        for handler in self.handlers.get(msg.command, ()):
+            try:
+                handler(msg, server)
+            except Exception as e:
+                print(f"Error in {msg.command} handler: {e}")
+                self.add_status_message(f"Error handling {msg.command}: {e}")
+            if stats:
+                now = perf_counter_ns()
+                stats.record(msg.command, handler, now - started)
+                started = now
+
+        if stats:
+            elapsed = started - line_start
+            if elapsed > stats.budget_ns:
+                stats.slow_lines += 1
+                print(f"WARNING - Slow line from {server}: {msg.command} took "
+                      f"{elapsed / 1e6:.1f} ms (budget {stats.budget_ns / 1e6:.0f} ms)")
+
+    def handle_error(self, msg, server):
+        # The server closes the link right after this; the reconnect
+        # supervisor takes over from connection_lost()
+        self.add_status_message(f"Server {server} disconnected: {msg.trailing}")
+
+    def handle_ping(self, msg, server):
+        # Answered by receive_line() on the network thread
+        self.add_status_message(f"PONG sent to {server}")
+
+    def handle_welcome(self, msg, server):
+        """RPL_WELCOME, registration done"""
+        self.registered(server, msg.params[0])
+
+    def handle_nick_in_use(self, msg, server):
+        """ERR_NICKNAMEINUSE: <me> <nick> :Nickname is already in use"""
+        conn = self.connections.get(server)
+        if len(msg.params) > 2:
+            self.add_status_message(f"Nickname {msg.params[1]} is already in use on {server}")
+        if conn is None or conn.registered:
+            return  # A /nick change was refused, the current nick stays
+        # Still registering, e.g. after a dead link whose old session holds our nick
+        if conn.nick_attempts >= self.NICK_ATTEMPTS:
+            self.add_status_message(f"No free nickname found on {server}, use /nick to pick one")
+            return
+        conn.nick_attempts += 1
+        conn.nickname = f"{conn.nickname}_"
+        self.send_command(f"NICK {conn.nickname}", server, priority=True)
+
+    def handle_isupport(self, msg, server):
+        """RPL_ISUPPORT: <me> <token>... :are supported by this server"""
+        isupport = self.connections[server].isupport
+        casemapping, prefixes = isupport.casemapping, isupport.prefixes
+        isupport.update(msg.params[1:-1])
+        if isupport.casemapping != casemapping:
+            self.rekey_windows(server)
+        if (isupport.casemapping, isupport.prefixes) != (casemapping, prefixes):
+            # Member rows are sorted by rank and folded nick, and the
+            # status bits follow the PREFIX order
+            for chan in list(self.channels.values()):
+                if chan.server == server:
+                    chan.rebuild_members()
+
+    def handle_mode(self, msg, server):
+        params = msg.params
+        if len(params) < 2:
+            return
+        setter = msg.nick
+        channel = params[0]
+        chan = self.channels.get(self.window_key(server, channel))
+        if chan is None:
+            return  # User mode on our own nick, or a channel we don't show
+        isupport = self.connections[server].isupport
+
+        descriptions = {
+            ('o', True): "gives channel operator status to",
+            ('o', False): "removes channel operator status from",
+            ('v', True): "gives voice to",
+            ('v', False): "removes voice from",
+        }
+        prefix_changes = []
+        mode_changes = []
+        for adding, mode, arg in isupport.parse_modes(params[1], params[2:]):
+            sign = '+' if adding else '-'
+            if mode in isupport.mode_bits:
+                if not arg:
+                    continue
+                prefix_changes.append((adding, isupport.mode_bits[mode], arg))
+                action = descriptions.get((mode, adding))
+                if action:
+                    chan.add_action(setter, f"{action} {arg}")
+                else:
+                    chan.add_action(setter, f"sets mode {sign}{mode} on {arg}")
+            else:
+                mode_changes.append((adding, mode, arg))
+                chan.add_action(setter, f"sets mode {sign}{mode}{' ' + arg if arg else ''}")
+
+        # Every change on the line lands first, then one list refresh
+        chan.apply_prefix_changes(prefix_changes)
+        chan.apply_mode_changes(mode_changes)
+        print(f"DEBUG - Mode change: {setter} sets {' '.join(params[1:])} on {channel}")
+
+    def handle_channel_modes(self, msg, server):
+        """RPL_CHANNELMODEIS: <me> <channel> <modes> [<args>...]"""
+        params = msg.params
+        if len(params) < 3:
+            return
+        chan = self.channels.get(self.window_key(server, params[1]))
+        if chan is not None:
+            chan.modes.clear()
+            chan.apply_mode_changes(chan.isupport.parse_modes(params[2], params[3:]))
+
+    def handle_topic(self, msg, server):
+        """TOPIC <channel> :<topic>, or RPL_TOPIC: <me> <channel> :<topic>"""
+        params = msg.params
+        if len(params) < 2:
+            return
+        channel = params[-2]
+        chan = self.channels.get(self.window_key(server, channel))
+        if chan is None:
+            return
+        chan.topic = params[-1]
+        if msg.command == 'TOPIC':
+            chan.add_message(f"* {msg.nick} changes the topic to: {chan.topic}", 'nick')
+        else:
+            chan.add_message(f"* Topic for {channel}: {chan.topic}", 'nick')
+
+    def handle_whois_user(self, msg, server):
+        """WHOIS user info, completes a pending host ban"""
+        target_nick = msg.params[1]
+        user_host = msg.params[2] + '@' + msg.params[3]
+        if target_nick in self.pending_bans:
+            ban = self.pending_bans.pop(target_nick)
+            channel = ban['channel']
+            ban_mask = f'*!{user_host}'
+            self.send_command(f'MODE {channel} +b {ban_mask}', server, priority=True)
+            if ban['kick']:
+                self.send_command(f'KICK {channel} {target_nick} :{ban["reason"]}', server, priority=True)
+
+    def handle_whois_end(self, msg, server):
+        """End of WHOIS"""
+        self.pending_bans.pop(msg.params[1], None)
+
+    def handle_list(self, msg, server):
+        """RPL_LIST"""
+        params = msg.params
+        if hasattr(self, 'channel_list_callback'):
+            self.channel_list_callback({
+                'channel': params[1],
+                'users': params[2],
+                'topic': params[3] if len(params) > 3 else ''
+            })
+
+    def handle_list_end(self, msg, server):
+        """End of channel list"""
+        self.add_status_message("End of channel list")
+
+    def handle_join(self, msg, server):
+        user = msg.nick
+        channel = msg.params[0]
+        chan = self.channels.get(self.window_key(server, channel))
+        print(f"DEBUG - JOIN: {user} to {channel} on {server}")  # Debug print
+        self.connections[server].add_member(user, channel)
+        
+        if chan is not None:
+            chan.add_member(user)
+            timestamp = datetime.now().strftime("[%H:%M:%S]")
+            chan.render(f"{timestamp} * {user} has joined {channel}\n", 'join')
+            
+            # Request NAMES list if we joined
+            if user == self.connections[server].nickname:
+                self.send_command(f"NAMES {channel}", server)
+
+    def handle_names(self, msg, server):
+        """NAMES reply: <me> [<channel type>] <channel> :<names>"""
+        channel = msg.params[-2]
+        chan = self.channels.get(self.window_key(server, channel))
+        print(f"DEBUG - Processing NAMES for {channel} on {server}")  # Debug print
+        
+        if chan is not None:
+            users = msg.params[-1].split()
+            
+            print(f"DEBUG - Users found: {users}")  # Debug print
+            
+            conn = self.connections[server]
+            # Start batch update if not already started
+            if not chan.batch_updating:
+                # The reply replaces the member list, so forget the old one
+                for user in chan.members:
+                    conn.remove_member(user, channel)
+                chan.begin_batch_update()
+            
+            # Add users to buffer
+            for user in users:
+                nick, modes = conn.isupport.parse_name(user)
+                nick = sys.intern(nick)
+                chan.names_buffer[nick] = modes
+                conn.add_member(nick, channel)
+
+    def handle_names_end(self, msg, server):
+        """End of NAMES"""
+        channel = msg.params[1]
+        chan = self.channels.get(self.window_key(server, channel))
+        print(f"DEBUG - End of NAMES for {channel} on {server}")  # Debug print
+        
+        if chan is not None:
+            # End batch update and process
+            chan.end_batch_update()
+            print(f"DEBUG - Final user list: {len(chan.members)} members")  # Debug print
+
+    def handle_privmsg(self, msg, server):
+        sender = msg.nick
+        target = msg.params[0]
+        message = msg.params[1].strip()
+        
+        # Handle ACTION messages
+        if message.startswith('\x01ACTION') and message.endswith('\x01'):
+            action_text = message[8:-1]
+            window = (self.channels.get(self.window_key(server, target))
+                      or self.private_windows.get(self.window_key(server, sender)))
+            if window is not None:
+                window.add_action(sender, action_text)
+        else:
+            # Handle regular messages
+            if self.connections[server].isupport.is_channel(target):  # Channel message
+                chan = self.channels.get(self.window_key(server, target))
+                if chan is not None:
+                    chan.add_message(f"{sender}: {message}")
+            else:  # Private message
+                pm_key = self.window_key(server, sender)
+                if pm_key not in self.private_windows:
+                    self.create_private_window(sender, server)
+                self.private_windows[pm_key].add_message(f"{sender}: {message}")
+
+    def handle_part(self, msg, server):
+        user = msg.nick
+        channel = msg.params[0]
+        conn = self.connections[server]
+        if user == conn.nickname:
+            conn.forget_channel(channel)
+        else:
+            conn.remove_member(user, channel)
+        chan = self.channels.get(self.window_key(server, channel))
+        if chan is not None:
+            chan.remove_user(user)
+            chan.add_message(f"* {user} has left {channel}")
+
+    def handle_kick(self, msg, server):
+        params = msg.params
+        if len(params) < 2:
+            return
+        kicker = msg.nick
+        channel = params[0]
+        kicked_user = params[1]
+        reason = params[2] if len(params) > 2 else "No reason given"
+        
+        conn = self.connections[server]
+        if kicked_user == conn.nickname:
+            conn.forget_channel(channel)
+        else:
+            conn.remove_member(kicked_user, channel)
 
+        channel_key = self.window_key(server, channel)
+        if channel_key in self.channels:
+            chan = self.channels[channel_key]
             
-            # Handle LIST response (322)
-            elif '322' in data:  # RPL_LIST
-                try:
-                    parts = data.split()
-                    channel = parts[3]
-                    users = parts[4]
-                    topic = ' '.join(parts[5:]).lstrip(':')
-                    if hasattr(self, 'channel_list_callback'):
-                        self.channel_list_callback({
-                            'channel': channel,
-                            'users': users,
-                            'topic': topic
-                        })
-                except Exception as e:
-                    self.add_status_message(f"Error handling channel list: {e}")
-                return
+            # Add kick message to channel
+            timestamp = datetime.now().strftime("[%H:%M:%S]")
+            chan.render(f"{timestamp} * {kicked_user} was kicked by {kicker} ({reason})\n", 'kick')
+            
+            # If we're the one who got kicked
+            if kicked_user == self.connections[server].nickname:
+                # Remove from network tree
+                self.remove_channel_node(channel, server)
                 
-            # Handle end of LIST (323)
-            if ' 323 ' in data:  # End of channel list
-                self.add_status_message("End of channel list")
-                return
-
-            if 'JOIN' in data:
-                try:
-                    parts = data.split('!')
-                    if len(parts) > 1:
-                        user = parts[0].lstrip(':')
-                        channel = data.split('JOIN')[1].strip().lstrip(':')
-                        channel_key = f"{server}:{channel}"
-                        print(f"DEBUG - JOIN: {user} to {channel_key}")  # Debug print
-                        
-                        if channel_key in self.channel_windows:
-                            window = self.channel_windows[channel_key]
-                            window.users.add(user)
-                            window.update_users_list()
-                            timestamp = datetime.now().strftime("[%H:%M:%S]")
-                            window.chat_display.insert(tk.END, f"{timestamp} * {user} has joined {channel}\n", 'join')
-                            window.chat_display.see(tk.END)
-                            
-                            # Request NAMES list if we joined
-                            if user == self.connections[server]['nickname']:
-                                self.send_command(f"NAMES {channel}", server)
-                                
-                except Exception as e:
-                    print(f"Error handling JOIN: {e}")  # Debug print
-                    self.add_status_message(f"Error handling join: {e}")
-                    
-            if '353' in data:  # NAMES reply
-                try:
-                    # Parse channel name
-                    channel = None
-                    channel_type = None
-                    
-                    # Split the message parts
-                    parts = data.split()
-                    for i, part in enumerate(parts):
-                        if part in ['=', '*', '@']:  # Channel type indicators
-                            channel_type = part
-                            if i + 1 < len(parts):
-                                channel = parts[i + 1]
-                                break
-                        elif part.startswith('#'):
-                            channel = part
-                            break
-                    
-                    if channel:
-                        channel_key = f"{server}:{channel}"
-                        print(f"DEBUG - Processing NAMES for {channel_key}")  # Debug print
-                        
-                        if channel_key in self.channel_windows:
-                            window = self.channel_windows[channel_key]
-                            
-                            # Get the users part (after the last ':')
-                            users_part = data.split(':', 2)[-1].strip()
-                            users = users_part.split()
-                            
-                            print(f"DEBUG - Users found: {users}")  # Debug print
-                            
-                            # Start batch update if not already started
-                            if not window.batch_updating:
-                                window.begin_batch_update()
-                            
-                            # Add users to buffer
-                            window.names_buffer.update(users)
-                            
-                except Exception as e:
-                    print(f"Error processing NAMES: {e}")  # Debug print
-                    self.add_status_message(f"Error processing NAMES: {e}")
-                    
-            # Handle end of NAMES list (366)
-            elif '366' in data:  # End of NAMES
-                try:
-                    # Find channel name
-                    channel = None
-                    parts = data.split()
-                    for part in parts:
-                        if part.startswith('#'):
-                            channel = part
-                            break
-                    
-                    if channel:
-                        channel_key = f"{server}:{channel}"
-                        print(f"DEBUG - End of NAMES for {channel_key}")  # Debug print
-                        
-                        if channel_key in self.channel_windows:
-                            window = self.channel_windows[channel_key]
-                            # End batch update and process
-                            window.end_batch_update()
-                            print(f"DEBUG - Final user list: {window.users}")  # Debug print
-                            
-                except Exception as e:
-                    print(f"Error handling end of NAMES: {e}")  # Debug print
-                    self.add_status_message(f"Error handling end of NAMES: {e}")
-
-            elif 'PRIVMSG' in data:
-                try:
-                    parts = data.split('!')
-                    if len(parts) > 1:
-                        sender = parts[0].lstrip(':')
-                        target = data.split('PRIVMSG')[1].split(':', 1)[0].strip()
-                        message = data.split('PRIVMSG')[1].split(':', 1)[1].strip()
-                        
-                        # Handle ACTION messages
-                        if message.startswith('\x01ACTION') and message.endswith('\x01'):
-                            action_text = message[8:-1]
-                            channel_key = f"{server}:{target}"
-                            if channel_key in self.channel_windows:
-                                self.channel_windows[channel_key].add_action(sender, action_text)
-                            elif sender in self.private_windows:
-                                self.private_windows[sender].add_action(sender, action_text)
-                        else:
-                            # Handle regular messages
-                            if target.startswith('#'):  # Channel message
-                                channel_key = f"{server}:{target}"
-                                if channel_key in self.channel_windows:
-                                    self.channel_windows[channel_key].add_message(f"{sender}: {message}")
-                            else:  # Private message
-                                if sender not in self.private_windows:
-                                    self.create_private_window(sender, server)
-                                self.private_windows[sender].add_message(f"{sender}: {message}")
-                                
-                except Exception as e:
-                    self.add_status_message(f"Error handling message: {e}")
-
-
-            elif 'PART' in data:
-                try:
-                    parts = data.split('!')
-                    if len(parts) > 1:
-                        user = parts[0].lstrip(':')
-                        channel = data.split('PART')[1].split()[0].strip()
-                        channel_key = f"{server}:{channel}"
-                        if channel_key in self.channel_windows:
-                            self.channel_windows[channel_key].users.discard(user)
-                            self.channel_windows[channel_key].update_users_list()
-                            self.channel_windows[channel_key].add_message(f"* {user} has left {channel}")
-                except Exception as e:
-                    self.add_status_message(f"Error handling part: {e}")
-
-
-
-            if 'KICK' in data:
-                try:
-                    parts = data.split()
-                    if len(parts) >= 4:
-                        kicker = parts[0].split('!')[0].lstrip(':')
-                        channel = parts[2]
-                        kicked_user = parts[3]
-                        reason = data.split(':', 2)[-1].strip() if ':' in data else "No reason given"
-                        
-                        channel_key = f"{server}:{channel}"
-                        if channel_key in self.channel_windows:
-                            window = self.channel_windows[channel_key]
-                            
-                            # Add kick message to channel
-                            timestamp = datetime.now().strftime("[%H:%M:%S]")
-                            window.chat_display.insert(tk.END, 
-                                f"{timestamp} * {kicked_user} was kicked by {kicker} ({reason})\n", 
-                                'kick')
-                            window.chat_display.see(tk.END)
-                            
-                            # If we're the one who got kicked
-                            if kicked_user == self.connections[server]['nickname']:
-                                # Remove from network tree
-                                self.remove_channel_node(channel)
-                                
-                                # Remove from channel windows dict and destroy window
-                                window.window.destroy()
-                                del self.channel_windows[channel_key]
-                                
-                                self.add_status_message(f"You were kicked from {channel} by {kicker} ({reason})")
-                            else:
-                                # Someone else was kicked, update the user list
-                                window.remove_user(kicked_user)
-                                
-                            print(f"DEBUG - Kick processed: {kicked_user} from {channel} by {kicker}")
-                            
-                except Exception as e:
-                    print(f"Error handling kick: {e}")
-                    self.add_status_message(f"Error handling kick: {e}")
-
-            elif 'QUIT' in data:
-                try:
-                    parts = data.split('!')
-                    if len(parts) > 1:
-                        user = parts[0].lstrip(':')
-                        quit_message = data.split(':', 2)[-1].strip()
-                        # Remove user from all channels they were in
-                        for channel_window in self.channel_windows.values():
-                            if user in channel_window.users:
-                                channel_window.users.discard(user)
-                                channel_window.update_users_list()
-                                channel_window.add_message(f"* {user} has quit ({quit_message})")
-                except Exception as e:
-                    self.add_status_message(f"Error handling quit: {e}")
-
-            elif 'NICK' in data:
-                try:
-                    parts = data.split('!')
-                    if len(parts) > 1:
-                        old_nick = parts[0].lstrip(':')
-                        new_nick = data.split(':', 2)[-1].strip()
-                        
-                        # Update nickname in server connections if it's our nick
-                        if old_nick == self.connections[server]['nickname']:
-                            self.connections[server]['nickname'] = new_nick
-                        
-                        # Update nickname in all channels
-                        for channel_window in self.channel_windows.values():
-                            if old_nick in channel_window.users:
-                                channel_window.users.discard(old_nick)
-                                channel_window.users.add(new_nick)
-                                channel_window.update_users_list()
-                                channel_window.add_message(f"* {old_nick} is now known as {new_nick}")
-                except Exception as e:
-                    self.add_status_message(f"Error handling nick: {e}")
+                # Forget the channel and destroy its window
+                chan.is_closing = True
+                chan.close_view()
+                del self.channels[channel_key]
+                
+                self.add_status_message(f"You were kicked from {channel} by {kicker} ({reason})")
+            else:
+                # Someone else was kicked, update the user list
+                chan.remove_user(kicked_user)
+                
+            print(f"DEBUG - Kick processed: {kicked_user} from {channel} by {kicker}")
+
+    def handle_quit(self, msg, server):
+        user = msg.nick
+        quit_message = msg.trailing
+        # Remove user from the channels they were in, and only those
+        for channel in self.connections[server].remove_nick(user):
+            chan = self.channels.get((server, channel))
+            if chan is not None:
+                chan.remove_user(user)
+                chan.add_message(f"* {user} has quit ({quit_message})")
+
+    def handle_nick(self, msg, server):
+        old_nick = msg.nick
+        new_nick = msg.params[0]
+        
+        # Update nickname in server connections if it's our nick
+        conn = self.connections[server]
+        if old_nick == conn.nickname:
+            conn.nickname = new_nick
+        
+        # Update nickname in the channels the user is in
+        for channel in conn.rename_member(old_nick, new_nick):
+            chan = self.channels.get((server, channel))
+            if chan is not None:
+                chan.rename_user(old_nick, new_nick)
+                chan.add_message(f"* {old_nick} is now known as {new_nick}")
 
-        except Exception as e:
-            self.add_status_message(f"Error parsing server message: {e}")
-            
     def create_channel_window(self, channel, server):
-        """Create a new channel window"""
-        channel_key = f"{server}:{channel}"
-        if channel_key not in self.channel_windows:
-            self.channel_windows[channel_key] = ChannelWindow(self, channel, server)
-            self.add_channel_node(channel)  # Add to tree
+        """Track a joined channel; its window is built when opened from the tree"""
+        channel_key = self.window_key(server, channel)
+        if channel_key not in self.channels:
+            self.channels[channel_key] = Channel(self, channel, server)
+            self.add_channel_node(channel, server)  # Add to tree
             self.send_command(f"NAMES {channel}", server)
             self.add_status_message(f"Joined channel: {channel} on {server}")
 
 
 
-    def receive_messages(self, server):
-        """Receive messages from a specific server"""
-        while self.running:
-            try:
-                with self.lock:
-                    if server not in self.connections:
-                        break
-                    
-                    conn = self.connections[server]
-                    try:
-                        # Set a timeout on the socket
-                        conn['socket'].settimeout(180)  # 3 minutes timeout
-                        data = conn['socket'].recv(4096).decode('utf-8')
-                        if not data:
-                            raise ConnectionError("Server closed connection")
-                    except (socket.timeout, TimeoutError):
-                        raise ConnectionError("Connection timed out")
-                    except UnicodeDecodeError:
-                        try:
-                            data = conn['socket'].recv(4096).decode('latin-1')
-                        except:
-                            data = conn['socket'].recv(4096).decode('iso-8859-1')
-                    
-                    if not data:
-                        break
-                    
-                    # Process received data
-                    conn['buffer'] += data
-                    lines = conn['buffer'].split('\r\n')
-                    conn['buffer'] = lines.pop()
-                    
-                    for line in lines:
-                        if line:  # Only process non-empty lines
-                            self.handle_server_message(line, server)
-                        
-            except Exception as e:
-                self.add_status_message(f"Error receiving from {server}: {e}")
-                # Clean up the connection
-                with self.lock:
-                    if server in self.connections:
-                        try:
-                            self.connections[server]['socket'].close()
-                        except:
-                            pass
-                        del self.connections[server]
-                        self.remove_server_node(server)
-                break
-                
+    def connection_lost(self, conn, error):
+        """Handle a dead connection reported by the network engine"""
+        if not self.on_gui_thread():
+            self.post_event(self.connection_lost, conn, error)
+            return
+        server = conn.server
+        if self.connections.get(server) is not conn:
+            return  # Already quit or replaced
+        if conn.auto_reconnect:
+            self.schedule_reconnect(conn, error)
+            return
+        self.add_status_message(f"Error receiving from {server}: {error}")
+        del self.connections[server]
+        self.remove_server_node(server)
+
+    def create_connection(self, server, port, nickname):
+        """Create connection state using the configured encoding and flood settings"""
+        flood_burst, flood_rate = self.flood_settings.get(
+            server, (self.preferences['flood_burst'], self.preferences['flood_rate'])
+        )
+        return ServerConnection(
+            server, port, nickname,
+            encoding=self.preferences['encoding'],
+            fallback_encoding=self.preferences['fallback_encoding'],
+            flood_burst=flood_burst,
+            flood_rate=flood_rate,
+            write_budget=self.preferences['write_budget'],
+            heartbeat_interval=self.preferences['heartbeat_interval'],
+            lag_threshold=self.preferences['lag_threshold']
+        )
+
     def connect_to_server(self, server, port, nickname):
-        """Connect to a new server"""
+        """Start connecting to a new server; progress is reported to the status window"""
         try:
             # Check if already connected
             if server in self.connections:
                 self.add_status_message(f"Already connected to {server}")
                 return False
 
-            # Create new socket connection (simplified)
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.connect((server, port))
-            
             # Store connection info
-            self.connections[server] = {
-                'socket': sock,
-                'nickname': nickname,
-                'channels': {},
-                'buffer': ""
-            }
+            conn = self.create_connection(server, port, nickname)
+            self.connections[server] = conn
             
             # Add server to tree
             self.add_server_node(server)
             self.current_server = server
             
-            # Send initial commands
-            self.send_command(f"NICK {nickname}", server)
-            self.send_command(f"USER {nickname} 0 * :{nickname}", server)
-            
-            # Start receive thread
-            receive_thread = threading.Thread(target=self.receive_messages, args=(server,))
-            receive_thread.daemon = True
-            receive_thread.start()
-            
-            self.add_status_message(f"Connected to {server}")
+            # Resolve and connect on the network engine, without blocking the GUI
+            self.add_status_message(f"Connecting to {server}:{port}...")
+            self.engine.connect(conn)
             return True
             
         except Exception as e:
@@ -2355,6 +3927,92 @@ class IRCClient:
             if server in self.server_nodes:
                 self.remove_server_node(server)
             return False
+
+    def schedule_reconnect(self, conn, error):
+        """Retry a lost server with jittered exponential backoff, keeping its windows open"""
+        server = conn.server
+        delay = min(self.RECONNECT_MAX_DELAY, self.RECONNECT_BASE_DELAY * 2 ** conn.reconnect_attempts)
+        delay *= random.uniform(0.5, 1.0)  # Jitter so networks lost together don't retry in lockstep
+        conn.reconnect_attempts += 1
+        self.add_status_message(f"Lost connection to {server}: {error} - reconnecting in {delay:.1f}s")
+
+        for chan in list(self.channels.values()):
+            if chan.server == server:
+                chan.add_message(f"*** Lost connection to {server}, reconnecting...", 'quit')
+
+        # Timers live on the network thread; the reconnect itself runs here
+        self.engine.call_soon(self.engine.call_later, delay, self.post_event, self.reconnect, conn)
+
+    def reconnect(self, old_conn):
+        """Replace a dead connection with a fresh attempt"""
+        server = old_conn.server
+        if not self.running or self.connections.get(server) is not old_conn:
+            return  # The user quit the server meanwhile
+        conn = self.create_connection(server, old_conn.port, old_conn.nickname)
+        conn.auto_reconnect = True
+        conn.reconnect_attempts = old_conn.reconnect_attempts
+        self.connections[server] = conn
+        # The new connection starts from the default PREFIX until its 005 arrives
+        for chan in list(self.channels.values()):
+            if chan.server == server:
+                chan.rebuild_members()
+        self.add_status_message(f"Reconnecting to {server} (attempt {conn.reconnect_attempts})...")
+        self.engine.connect(conn)
+
+    def registered(self, server, nickname):
+        """Handle RPL_WELCOME: registration is complete"""
+        conn = self.connections.get(server)
+        if conn is None:
+            return
+        conn.nickname = nickname  # The server may have changed it
+        conn.registered = True
+        if conn.reconnect_attempts:
+            self.add_status_message(f"Reconnected to {server}")
+            self.rejoin_channels(server)
+        conn.auto_reconnect = True
+        conn.reconnect_attempts = 0
+
+    def rejoin_channels(self, server):
+        """Rejoin every channel we are still in, packing several into each JOIN"""
+        channels = [
+            chan.channel_name for chan in list(self.channels.values())
+            if chan.server == server
+        ]
+        batch = ""
+        for channel in channels:
+            if batch and len(batch) + 1 + len(channel) > self.JOIN_BATCH_LENGTH:
+                self.send_command(f"JOIN {batch}", server)
+                batch = channel
+            else:
+                batch = f"{batch},{channel}" if batch else channel
+        if batch:
+            self.send_command(f"JOIN {batch}", server)
+
+    def connection_progress(self, conn, message):
+        """Report connection progress from the network engine"""
+        self.add_status_message(f"{conn.server}: {message}")
+
+    def connection_established(self, conn, address):
+        """Register with the server once the network engine has connected"""
+        self.add_status_message(f"Connected to {conn.server} ({address})")
+        # Registration goes ahead of anything the user queued while connecting
+        self.send_command(f"NICK {conn.nickname}", conn.server, priority=True)
+        self.send_command(f"USER {conn.nickname} 0 * :{conn.nickname}", conn.server, priority=True)
+
+    def connection_failed(self, conn, error):
+        """Clean up after every connection attempt to a server failed"""
+        if not self.on_gui_thread():
+            self.post_event(self.connection_failed, conn, error)
+            return
+        server = conn.server
+        if self.connections.get(server) is not conn:
+            return
+        if conn.auto_reconnect:
+            self.schedule_reconnect(conn, error)
+            return
+        self.add_status_message(f"Failed to connect to {server}: {error}")
+        del self.connections[server]
+        self.remove_server_node(server)
                 
     def run(self):
         """Start the IRC client"""
@@ -2362,23 +4020,21 @@ class IRCClient:
             # Start the GUI main loop
             self.status_window.mainloop()
         finally:
-            # Cleanup when the program exits
+            # Cleanup when the program exits; the engine closes every socket
             self.running = False
-            with self.lock:
-                for server, conn in self.connections.items():
-                    try:
-                        conn['socket'].close()
-                    except:
-                        pass
+            self.engine.stop()
 
 def main():
-    server = "irc.libera.chat"
-    port = 6667
+    networks = [
+        ("irc.libera.chat", 6667),
+    ]
     nickname = "Mahmood Dzay"
     
+    server, port = networks[0]
     client = IRCClient(server, port, nickname)
-    # Connect to default server after initialization
-    client.connect_to_server(server, port, nickname)
+    # Connect to every configured network; the connections come up concurrently
+    for server, port in networks:
+        client.connect_to_server(server, port, nickname)
     client.run()
 
 
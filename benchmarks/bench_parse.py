@@ -0,0 +1,39 @@
+"""Message.parse throughput over a recorded session (benchmarks/corpus.irc)
+
+Run with: python3 benchmarks/bench_parse.py
+"""
+import os
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import IRCurd
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus.irc')
+ROUNDS = 200
+
+
+def load(path=CORPUS):
+    """The corpus lines as the receive path hands them over: decoded, without CRLF"""
+    with open(path, 'rb') as corpus:
+        return [line for line in corpus.read().decode('utf-8').split('\r\n') if line]
+
+
+def run(lines):
+    """Seconds to parse every corpus line once"""
+    parse = IRCurd.Message.parse
+    started = time.perf_counter()
+    for line in lines:
+        parse(line)
+    return time.perf_counter() - started
+
+
+if __name__ == '__main__':
+    lines = load()
+    commands = Counter(IRCurd.Message.parse(line).command for line in lines)
+    mix = ", ".join(f"{command} {count}" for command, count in commands.most_common(5))
+    print(f"corpus   {len(lines)} lines, {len(commands)} commands ({mix}, ...)")
+    elapsed = min(run(lines) for _ in range(ROUNDS))
+    print(f"parse    {elapsed / len(lines) * 1e6:5.2f} us/line, {len(lines) / elapsed:,.0f} lines/s")
@@ -0,0 +1,98 @@
+"""Receive path: pooled recv_into buffers scanned in place, against the old recv/decode/split loop
+
+Run with: python3 benchmarks/bench_receive.py
+"""
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import IRCurd
+
+LINES = 200000
+LINE = b":nick!user@host.example PRIVMSG #channel :a fairly ordinary line of chat text\r\n"
+CHUNK = 4096
+
+
+def feed(sock):
+    """Write the test stream from a helper thread so the reader never blocks the writer"""
+    data = LINE * LINES
+    thread = threading.Thread(target=lambda: (sock.sendall(data), sock.shutdown(socket.SHUT_WR)))
+    thread.start()
+    return thread
+
+
+class OldReader:
+    """The receive loop before ReceiveBuffer: a bytes chunk, a str and a split list per read"""
+    def __init__(self):
+        self.buffer = ""
+
+    def read(self, sock):
+        """Lines completed by one read, or None at EOF"""
+        data = sock.recv(CHUNK)
+        if not data:
+            return None
+        self.buffer += data.decode('utf-8', errors='replace')
+        lines = self.buffer.split('\r\n')
+        self.buffer = lines.pop()
+        return lines
+
+    def close(self):
+        pass
+
+
+class NewReader:
+    """recv_into a pooled buffer, the complete lines decoded and split in one go"""
+    def __init__(self):
+        self.conn = IRCurd.ServerConnection('irc.test', 6667, 'bench')
+        self.buffer = IRCurd.ReceiveBuffer.acquire()
+
+    def read(self, sock):
+        """Lines completed by one read, or None at EOF"""
+        if not self.buffer.recv_from(sock):
+            return None
+        raw = self.buffer.complete()
+        return [] if raw is None else self.conn.decode_lines(raw)
+
+    def close(self):
+        self.buffer.release()
+
+
+def run(reader_type, counted=False):
+    """Seconds taken to receive the whole stream, or allocated blocks per line if counted"""
+    reader, writer = socket.socketpair()
+    writer_thread = feed(writer)
+    source = reader_type()
+    count = blocks = 0
+    started = time.perf_counter()
+    while True:
+        if counted:
+            # Blocks allocated by one read and the lines it yields, while they are alive
+            lines = None
+            before = sys.getallocatedblocks()
+            lines = source.read(reader)
+            blocks += sys.getallocatedblocks() - before
+        else:
+            lines = source.read(reader)
+        if lines is None:
+            break
+        for line in lines:
+            if line:
+                count += 1
+    elapsed = time.perf_counter() - started
+    source.close()
+    writer_thread.join()
+    reader.close()
+    writer.close()
+    assert count == LINES, count
+    return blocks / LINES if counted else elapsed
+
+
+if __name__ == '__main__':
+    for name, reader_type in (("recv/decode/split", OldReader), ("ReceiveBuffer", NewReader)):
+        elapsed = min(run(reader_type) for _ in range(3))
+        blocks = run(reader_type, counted=True)
+        print(f"{name:20} {elapsed / LINES * 1e6:6.2f} us/line  {blocks:5.2f} allocated blocks/line")
@@ -0,0 +1,53 @@
+"""Write path: syscalls needed to flush queued lines, one line per write against coalesced writes
+
+Run with: python3 benchmarks/bench_write.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import IRCurd
+
+LINES = 200
+
+
+class CountingSocket:
+    """Accepts everything and counts the send calls it took"""
+    def __init__(self):
+        self.calls = 0
+        self.bytes = 0
+
+    def send(self, data):
+        self.calls += 1
+        self.bytes += len(data)
+        return len(data)
+
+    def sendmsg(self, buffers):
+        self.calls += 1
+        size = sum(len(buffer) for buffer in buffers)
+        self.bytes += size
+        return size
+
+
+def flush(write_budget):
+    """Queue LINES JOINs and flush them; returns (syscalls, seconds)"""
+    engine = IRCurd.NetworkEngine(None)
+    conn = IRCurd.ServerConnection('irc.test', 6667, 'bench', flood_burst=LINES,
+                                   write_budget=write_budget)
+    conn.socket = CountingSocket()
+    for n in range(LINES):
+        conn.sendq.append(f"JOIN #channel{n}\r\n".encode())
+    started = time.perf_counter()
+    engine._handle_write(conn)
+    elapsed = time.perf_counter() - started
+    engine.shutdown()
+    assert not conn.wireq and not conn.sendq
+    return conn.socket.calls, elapsed
+
+
+if __name__ == '__main__':
+    for budget in (1, 512, 4096):
+        calls, elapsed = flush(budget)
+        print(f"write_budget {budget:5}: {calls:3} syscalls for {LINES} lines, {elapsed * 1e6:7.1f} us")
@@ -0,0 +1,120 @@
+"""Channel member bookkeeping, headless"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import IRCurd
+
+
+class FakeConnection:
+    def __init__(self):
+        self.isupport = IRCurd.ISupport()
+        self.nickname = 'me'
+
+
+class FakeClient:
+    """The parts of IRCClient a Channel without a window uses"""
+    def __init__(self):
+        self.preferences = {'channel_backlog': 50}
+        self.connections = {'irc.test': FakeConnection()}
+        self.default_isupport = IRCurd.ISupport()
+        self.status = []
+
+    def add_status_message(self, message):
+        self.status.append(message)
+
+
+class PrefixChangeTest(unittest.TestCase):
+    def setUp(self):
+        self.client = FakeClient()
+        self.channel = IRCurd.Channel(self.client, '#test', 'irc.test')
+
+    def names(self, *entries):
+        isupport = self.client.connections['irc.test'].isupport
+        self.channel.begin_batch_update()
+        for entry in entries:
+            nick, modes = isupport.parse_name(entry)
+            self.channel.names_buffer[nick] = modes
+        self.channel.end_batch_update()
+
+    def test_prefix_change_remaps_member_bits(self):
+        self.names('@op', '+voiced', '@+both', 'plain')
+        self.client.connections['irc.test'].isupport.update(['PREFIX=(v)+'])
+        self.channel.rebuild_members()
+        self.assertEqual(self.channel.sorted_users(), ['+both', '+voiced', 'op', 'plain'])
+        self.assertEqual([self.channel.user_row(i)[0] for i in range(4)],
+                         ['+both', '+voiced', 'op', 'plain'])
+
+    def test_reconnect_to_default_prefix(self):
+        self.client.connections['irc.test'].isupport.update(['PREFIX=(qaohv)~&@%+'])
+        self.channel.rebuild_members()
+        self.names('~owner', '&admin', '@op', '%half', '+voiced', 'plain')
+
+        # A fresh connection knows only the default (ov)@+ until its 005
+        self.client.connections['irc.test'] = FakeConnection()
+        self.channel.rebuild_members()
+        self.assertEqual(self.channel.sorted_users(), ['@op', '+voiced', 'admin', 'half', 'owner', 'plain'])
+
+    def test_prefix_of_unknown_bit(self):
+        isupport = IRCurd.ISupport()
+        self.assertEqual(isupport.prefix_of(0), '')
+        self.assertEqual(isupport.prefix_of(1), '@')
+        self.assertEqual(isupport.prefix_of(1 << 4), '')
+
+
+class ModeClient(IRCurd.IRCClient):
+    """IRCClient with one headless channel and no window or network engine"""
+    def __init__(self):
+        FakeClient.__init__(self)
+        self.channel = IRCurd.Channel(self, '#c', 'irc.test')
+        self.channels = {self.window_key('irc.test', '#c'): self.channel}
+
+    def add_status_message(self, message):
+        self.status.append(message)
+
+
+class ModeTest(unittest.TestCase):
+    def setUp(self):
+        self.client = ModeClient()
+        self.channel = self.client.channel
+        self.isupport = self.client.connections['irc.test'].isupport
+
+    def mode(self, line):
+        self.client.handle_mode(IRCurd.Message.parse(line), 'irc.test')
+
+    def test_parse_every_change(self):
+        self.assertEqual(self.isupport.parse_modes('+ooo-v', ['a', 'b', 'c', 'd']), [
+            (True, 'o', 'a'), (True, 'o', 'b'), (True, 'o', 'c'), (False, 'v', 'd')
+        ])
+
+    def test_parse_argument_types(self):
+        """List (A) and key (B) modes always take an argument, limit (C) only when set, flags (D) never"""
+        changes = self.isupport.parse_modes('+bklm-lk+o', ['*!*@spam', 'secret', '10', 'secret', 'a'])
+        self.assertEqual(changes, [
+            (True, 'b', '*!*@spam'), (True, 'k', 'secret'), (True, 'l', '10'), (True, 'm', None),
+            (False, 'l', None), (False, 'k', 'secret'), (True, 'o', 'a'),
+        ])
+
+    def test_every_change_on_the_line_applies(self):
+        for nick in 'abc':
+            self.channel.add_member(nick)
+        self.channel.add_member('d', self.isupport.mode_bits['v'])
+        self.mode(":op!u@h MODE #c +ooo-v a b c d")
+        self.assertEqual(self.channel.sorted_users(), ['@a', '@b', '@c', 'd'])
+
+    def test_channel_modes_consume_their_arguments(self):
+        self.channel.add_member('a', self.isupport.mode_bits['o'])
+        self.channel.add_member('b')
+        self.mode(":op!u@h MODE #c +lkb-o+v 10 secret *!*@spam a b")
+        self.assertEqual(self.channel.modes, {'l': '10', 'k': 'secret'})
+        self.assertEqual(self.channel.sorted_users(), ['+b', 'a'])
+
+        self.mode(":op!u@h MODE #c -lk+o secret a")
+        self.assertEqual(self.channel.modes, {})
+        self.assertEqual(self.channel.sorted_users(), ['@a', '+b'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,319 @@
+"""NetworkEngine tests over socketpair(), no Tk or network needed"""
+import os
+import socket
+import sys
+import threading
+import time
+import unittest
+from concurrent.futures import Future
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import IRCurd
+
+
+class FakeClient:
+    """Stands in for IRCClient, recording what the engine reports"""
+    def __init__(self):
+        self.lines = {}  # conn -> received lines, in order
+        self.threads = set()
+        self.lost = []
+        self.established = []
+        self.changed = threading.Condition()
+
+    def receive_line(self, line, conn):
+        with self.changed:
+            self.lines.setdefault(conn, []).append(line)
+            self.threads.add(threading.get_ident())
+            self.changed.notify_all()
+
+    def connection_lost(self, conn, error):
+        with self.changed:
+            self.lost.append((conn, error))
+            self.changed.notify_all()
+
+    def connection_established(self, conn, address):
+        with self.changed:
+            self.established.append((conn, address))
+            self.changed.notify_all()
+
+    def connection_failed(self, conn, error):
+        pass
+
+    def connection_progress(self, conn, message):
+        pass
+
+    def wait_for(self, predicate, timeout=10.0):
+        with self.changed:
+            return self.changed.wait_for(predicate, timeout)
+
+
+def attach(engine, conn):
+    """Hand one end of a socket pair to the engine as conn's server socket; returns the other end"""
+    ours, theirs = socket.socketpair()
+    conn.socket = ours
+    engine.call_soon(engine._register, conn)
+    theirs.settimeout(5.0)
+    return theirs
+
+
+def read_lines(sock, count, timeout=5.0):
+    """Read count CRLF lines, or whatever arrived before EOF or the timeout"""
+    data = b''
+    deadline = time.monotonic() + timeout
+    while data.count(b'\r\n') < count and time.monotonic() < deadline:
+        try:
+            chunk = sock.recv(65536)
+        except socket.timeout:
+            break
+        if not chunk:
+            break
+        data += chunk
+    return data.split(b'\r\n')[:-1]
+
+
+class EngineTestCase(unittest.TestCase):
+    """Runs a NetworkEngine for each test and closes the peers afterwards"""
+    def setUp(self):
+        self.client = FakeClient()
+        self.engine = IRCurd.NetworkEngine(self.client)
+        self.engine.start()
+        self.peers = []
+
+    def tearDown(self):
+        self.engine.stop()
+        for peer in self.peers:
+            peer.close()
+
+    def connect(self, **options):
+        conn = IRCurd.ServerConnection('irc.test', 6667, 'tester', **options)
+        self.peers.append(attach(self.engine, conn))
+        return conn, self.peers[-1]
+
+
+class EngineStressTest(EngineTestCase):
+    CONNECTIONS = 50
+    LINES = 200
+
+    def test_connections_are_received_concurrently(self):
+        """Every connection's lines arrive complete and in order on the one I/O thread"""
+        conns = [self.connect() for _ in range(self.CONNECTIONS)]
+
+        # All servers talk at once, each from its own thread
+        def talk(index, peer):
+            for n in range(self.LINES):
+                peer.sendall(f":srv{index} PRIVMSG #c :line {n}\r\n".encode())
+
+        talkers = [threading.Thread(target=talk, args=(i, peer)) for i, (_, peer) in enumerate(conns)]
+        for talker in talkers:
+            talker.start()
+        for talker in talkers:
+            talker.join()
+
+        total = self.CONNECTIONS * self.LINES
+        self.assertTrue(self.client.wait_for(
+            lambda: sum(map(len, self.client.lines.values())) >= total
+        ))
+        for index, (conn, _) in enumerate(conns):
+            self.assertEqual(
+                self.client.lines[conn],
+                [f":srv{index} PRIVMSG #c :line {n}" for n in range(self.LINES)]
+            )
+        self.assertEqual(self.client.threads, {self.engine.thread.ident})
+        self.assertEqual(self.client.lost, [])
+
+    def test_shutdown_is_bounded(self):
+        """stop() closes every socket and returns well within its timeout"""
+        for _ in range(self.CONNECTIONS):
+            self.connect()
+        self.engine.call_soon(lambda: None)
+        time.sleep(0.1)  # Let the registrations run
+
+        started = time.monotonic()
+        self.engine.stop(timeout=2.0)
+        self.assertLess(time.monotonic() - started, 2.0)
+        self.assertFalse(self.engine.thread.is_alive())
+        self.assertEqual(self.engine.wakeup_reader.fileno(), -1)
+        self.assertEqual(self.engine.wakeup_writer.fileno(), -1)
+        for peer in self.peers:
+            self.assertEqual(peer.recv(1), b'')  # EOF, the engine closed its end
+
+
+class CloseTest(EngineTestCase):
+    def test_close_flushes_throttled_lines(self):
+        """A QUIT queued behind flood control still goes out on close()"""
+        conn, peer = self.connect(flood_burst=2, flood_rate=0.01)
+        for n in range(4):
+            self.engine.send(conn, f"PRIVMSG #c :{n}\r\n".encode())
+        self.engine.send(conn, b"QUIT :bye\r\n")
+        self.engine.close(conn)
+
+        lines = read_lines(peer, 5)
+        self.assertEqual(lines, [f"PRIVMSG #c :{n}".encode() for n in range(4)] + [b"QUIT :bye"])
+        self.assertEqual(peer.recv(1), b'')
+
+
+class EventErrorTest(EngineTestCase):
+    def test_error_fails_only_that_connection(self):
+        """An exception while handling one socket drops that connection and keeps the loop running"""
+        receive_line = self.client.receive_line
+
+        def fragile(line, conn):
+            if line == "boom":
+                raise RuntimeError("handler bug")
+            receive_line(line, conn)
+        self.client.receive_line = fragile
+
+        bad, bad_peer = self.connect()
+        good, good_peer = self.connect()
+        bad_peer.sendall(b"boom\r\n")
+        self.assertTrue(self.client.wait_for(lambda: self.client.lost))
+        good_peer.sendall(b"still here\r\n")
+        self.assertTrue(self.client.wait_for(lambda: good in self.client.lines))
+
+        self.assertTrue(self.engine.thread.is_alive())
+        self.assertEqual([conn for conn, _ in self.client.lost], [bad])
+        self.assertTrue(bad.closed)
+        self.assertEqual(bad_peer.recv(1), b'')
+        self.assertEqual(self.client.lines[good], ["still here"])
+
+
+class BackpressureTest(EngineTestCase):
+    def test_paused_connection_still_writes(self):
+        """A paused connection isn't read from, but its writes and other connections carry on"""
+        receive_line = self.client.receive_line
+
+        def pausing(line, conn):
+            receive_line(line, conn)
+            self.engine.pause_reading(conn)
+        self.client.receive_line = pausing
+
+        conn, peer = self.connect()
+        peer.sendall(b"PING :1\r\n")
+        self.assertTrue(self.client.wait_for(lambda: conn in self.client.lines))
+        peer.sendall(b"PING :2\r\n")
+        self.engine.send(conn, b"PONG :1\r\n", priority=True)
+        self.assertEqual(read_lines(peer, 1), [b"PONG :1"])
+
+        other, other_peer = self.connect()
+        other_peer.sendall(b"hello\r\n")
+        self.assertTrue(self.client.wait_for(lambda: other in self.client.lines))
+        self.assertEqual(self.client.lines[conn], ["PING :1"])
+
+        self.engine.call_soon(self.engine.resume_reading)
+        self.assertTrue(self.client.wait_for(lambda: len(self.client.lines[conn]) == 2))
+        self.assertEqual(self.client.lines[conn], ["PING :1", "PING :2"])
+
+    def test_shutdown_closes_paused_connections(self):
+        conn, peer = self.connect()
+        self.engine.call_soon(self.engine.pause_reading, conn)
+        self.engine.stop()
+        self.assertTrue(conn.closed)
+        self.assertEqual(peer.recv(1), b'')
+
+
+class HappyEyeballsTest(EngineTestCase):
+    def listen(self):
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        listener.listen()
+        self.peers.append(listener)
+        return (socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP, '', listener.getsockname())
+
+    def test_attempts_finishing_together(self):
+        """The loser of a race decided in one select() batch is dropped, not handled"""
+        self.engine.ATTEMPT_DELAY = 0  # Start both attempts before the loop selects
+        addresses = Future()
+        addresses.set_result([self.listen(), self.listen()])
+        conn = IRCurd.ServerConnection('irc.test', 6667, 'tester')
+        self.engine.call_soon(self.engine._resolved, conn, addresses)
+
+        self.assertTrue(self.client.wait_for(lambda: self.client.established))
+        time.sleep(0.1)  # Let the loop go round again
+        self.assertTrue(self.engine.thread.is_alive())
+        self.assertEqual(conn.attempts, [])
+        self.assertEqual(self.client.lost, [])
+
+
+class ReceiveBufferTest(unittest.TestCase):
+    def setUp(self):
+        self.ours, self.theirs = socket.socketpair()
+        self.addCleanup(self.ours.close)
+        self.addCleanup(self.theirs.close)
+        self.buffer = IRCurd.ReceiveBuffer()
+        self.conn = IRCurd.ServerConnection('irc.test', 6667, 'tester')
+
+    def receive(self, data):
+        """Feed data through the buffer, returning the lines completed by it"""
+        self.theirs.sendall(data)
+        received = 0
+        while received < len(data):
+            received += self.buffer.recv_from(self.ours)
+        raw = self.buffer.complete()
+        return [] if raw is None else self.conn.decode_lines(raw)
+
+    def test_lines_split_across_reads(self):
+        self.assertEqual(self.receive(b"PING :a\r\nPRIVMSG #c :caf\xc3"), ["PING :a"])
+        self.assertEqual(self.receive(b"\xa9\r"), [])
+        self.assertEqual(self.receive(b"\n"), ["PRIVMSG #c :caf\u00e9"])
+
+    def test_invalid_line_falls_back_alone(self):
+        self.assertEqual(self.receive(b"PRIVMSG #c :caf\xe9\r\nPRIVMSG #c :caf\xc3\xa9\r\n"),
+                         ["PRIVMSG #c :caf\u00e9", "PRIVMSG #c :caf\u00e9"])
+
+    def test_overlong_line_is_dropped(self):
+        """A server that never sends CRLF can't grow the buffer; the next line still arrives"""
+        size = len(self.buffer.data)
+        for _ in range(4):
+            self.assertEqual(self.receive(b"x" * 8000), [])
+        self.assertEqual(self.receive(b"x\r"), [])
+        self.assertEqual(self.receive(b"\nPING :after\r\n"), ["PING :after"])
+        self.assertEqual(len(self.buffer.data), size)
+
+    def test_longest_legal_line_is_kept(self):
+        line = b"@" + b"t" * 8190 + b" :srv PRIVMSG #c :" + b"m" * 490
+        self.assertLessEqual(len(line), IRCurd.ReceiveBuffer.MAX_LINE)
+        self.assertEqual(self.receive(line[:5000]), [])
+        self.assertEqual(self.receive(line[5000:] + b"\r\n"), [line.decode()])
+
+
+class CountingSocket:
+    """Accepts everything and counts the send calls it took"""
+    def __init__(self):
+        self.calls = 0
+        self.data = b''
+
+    def send(self, data):
+        self.calls += 1
+        self.data += bytes(data)
+        return len(data)
+
+    def sendmsg(self, buffers):
+        self.calls += 1
+        data = b''.join(buffers)
+        self.data += data
+        return len(data)
+
+
+class WriteCoalescingTest(unittest.TestCase):
+    def flush(self, write_budget):
+        engine = IRCurd.NetworkEngine(FakeClient())
+        self.addCleanup(engine.shutdown)
+        conn = IRCurd.ServerConnection('irc.test', 6667, 'tester', flood_burst=200,
+                                       write_budget=write_budget)
+        conn.socket = CountingSocket()
+        lines = [f"JOIN #channel{n}\r\n".encode() for n in range(200)]
+        conn.sendq.extend(lines)
+        engine._handle_write(conn)
+        self.assertEqual(conn.socket.data, b''.join(lines))
+        return conn.socket.calls
+
+    def test_queued_lines_go_out_in_one_write(self):
+        self.assertEqual(self.flush(4096), 1)
+
+    def test_write_budget_bounds_each_write(self):
+        self.assertEqual(self.flush(1), 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+"""Message.parse on the line shapes the handlers rely on"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import IRCurd
+
+
+class MessageParseTest(unittest.TestCase):
+    def test_prefix_and_trailing(self):
+        msg = IRCurd.Message.parse(":nick!user@host PRIVMSG #c :hello  there KICK")
+        self.assertEqual((msg.nick, msg.user, msg.host), ('nick', 'user', 'host'))
+        self.assertEqual(msg.command, 'PRIVMSG')
+        self.assertEqual(msg.params, ['#c', 'hello  there KICK'])
+
+    def test_server_numeric(self):
+        msg = IRCurd.Message.parse(":irc.example 353 me @ #secret :@op +voiced plain")
+        self.assertEqual(msg.nick, 'irc.example')
+        self.assertIsNone(msg.user)
+        self.assertEqual(msg.params, ['me', '@', '#secret', '@op +voiced plain'])
+
+    def test_no_prefix(self):
+        msg = IRCurd.Message.parse("ping :token")
+        self.assertIsNone(msg.prefix)
+        self.assertEqual((msg.command, msg.params), ('PING', ['token']))
+
+    def test_tags(self):
+        msg = IRCurd.Message.parse(r"@a=1;b=x\sy\:z;c :n!u@h TAGMSG #c")
+        self.assertEqual(msg.tags, {'a': '1', 'b': 'x y;z', 'c': ''})
+        self.assertEqual((msg.nick, msg.command, msg.params), ('n', 'TAGMSG', ['#c']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+"""Connection registration handlers, driven through dispatch without Tk"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import IRCurd
+
+
+class RegistrationClient(IRCurd.IRCClient):
+    """IRCClient without a window or network engine, recording what it would send"""
+    def __init__(self):
+        self.connections = {'irc.test': IRCurd.ServerConnection('irc.test', 6667, 'me')}
+        self.channels = {}
+        self.handlers = {}
+        self.register_builtin_handlers()
+        self.handler_stats = IRCurd.HandlerStats(enabled=False)
+        self.sent = []
+        self.status = []
+
+    def send_command(self, command, server=None, priority=False):
+        self.sent.append(command)
+
+    def add_status_message(self, message):
+        self.status.append(message)
+
+    def receive(self, line):
+        self.dispatch_message(IRCurd.Message.parse(line), line, 'irc.test')
+
+
+class NickInUseTest(unittest.TestCase):
+    def setUp(self):
+        self.client = RegistrationClient()
+        self.conn = self.client.connections['irc.test']
+
+    def test_alternate_nick_while_registering(self):
+        """A reconnect whose nick is still held by the old session registers under an alternate"""
+        self.client.receive(":irc.test 433 * me :Nickname is already in use")
+        self.assertEqual(self.client.sent, ["NICK me_"])
+        self.client.receive(":irc.test 433 * me_ :Nickname is already in use")
+        self.assertEqual(self.client.sent, ["NICK me_", "NICK me__"])
+
+        self.client.receive(":irc.test 001 me__ :Welcome")
+        self.assertTrue(self.conn.registered)
+        self.assertEqual(self.conn.nickname, "me__")
+
+    def test_nick_change_refused_after_registration(self):
+        self.client.receive(":irc.test 001 me :Welcome")
+        self.client.receive(":irc.test 433 me taken :Nickname is already in use")
+        self.assertEqual(self.client.sent, [])
+        self.assertEqual(self.conn.nickname, "me")
+
+    def test_attempts_are_bounded(self):
+        for _ in range(IRCurd.IRCClient.NICK_ATTEMPTS + 2):
+            self.client.receive(f":irc.test 433 * {self.conn.nickname} :Nickname is already in use")
+        self.assertEqual(len(self.client.sent), IRCurd.IRCClient.NICK_ATTEMPTS)
+        self.assertIn("use /nick", self.client.status[-1])
+
+
+if __name__ == '__main__':
+    unittest.main()
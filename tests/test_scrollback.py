@@ -0,0 +1,125 @@
+"""Scrollback tests against a stand-in for the Tk Text widget"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import IRCurd
+
+
+class FakeScrollbar:
+    def set(self, first, last):
+        pass
+
+
+class FakeText:
+    """Just enough of tk.Text for Scrollback: whole lines, a view height and idle callbacks"""
+    def __init__(self, height=20):
+        self.lines = []
+        self.height = height
+        self.top = 0  # Index of the first line in view
+        self.vbar = FakeScrollbar()
+        self.idle = []
+
+    def tag_configure(self, *args, **options):
+        pass
+
+    def configure(self, yscrollcommand=None):
+        self.yscrollcommand = yscrollcommand
+
+    def line(self, index):
+        return int(index.split('.')[0]) - 1
+
+    def index(self, index):
+        return f"{len(self.lines) + 1}.0"  # 'end-1c' after a trailing newline
+
+    def get(self, start, end):
+        return ''.join(self.lines[self.line(start):self.line(end)])
+
+    def delete(self, start, end):
+        del self.lines[self.line(start):self.line(end)]
+        self.top = max(0, min(self.top, len(self.lines) - self.height))
+
+    def insert(self, index, *segments):
+        text = ''.join(segments[::2])
+        if index == '1.0':
+            self.lines[0:0] = text.splitlines(True)
+        else:
+            self.lines += text.splitlines(True)
+
+    def see(self, index):
+        self.top = max(0, len(self.lines) - self.height)
+
+    def yview(self, *args):
+        if args:
+            self.top = self.line(args[0])
+            return
+        count = max(len(self.lines), 1)
+        return (self.top / count, min(1.0, (self.top + self.height) / count))
+
+    def after_idle(self, callback):
+        self.idle.append(callback)
+
+    def scroll_to_top(self):
+        self.top = 0
+        self.yscrollcommand(*self.yview())
+        while self.idle:
+            self.idle.pop(0)()
+
+
+class ScrollbackTest(unittest.TestCase):
+    LIMIT = 100
+    PAGE = 30
+
+    def setUp(self):
+        self.widget = FakeText()
+        self.scrollback = IRCurd.Scrollback(self.widget, self.LIMIT, self.PAGE)
+        self.sent = 0
+
+    def tearDown(self):
+        self.scrollback.close()
+
+    def add(self, count):
+        for _ in range(count):
+            self.scrollback.insert(f"line {self.sent}\n", 'message')
+            self.sent += 1
+
+    def numbers(self):
+        return [int(line.split()[1]) for line in self.widget.lines]
+
+    def test_trims_to_limit_and_keeps_every_line(self):
+        self.add(1000)
+        self.assertLessEqual(len(self.widget.lines), self.LIMIT + self.LIMIT // 10)
+        stored = self.scrollback.store
+        self.assertEqual(stored.read(0, len(stored)) + ''.join(self.widget.lines),
+                         ''.join(f"line {n}\n" for n in range(1000)))
+        self.assertEqual(self.widget.yview()[1], 1.0)  # Still following the end
+
+    def test_paged_in_history_survives_new_lines(self):
+        self.add(300)
+        first = self.numbers()[0]
+        self.widget.scroll_to_top()
+        self.assertEqual(self.numbers()[0], first - self.PAGE)
+        reading = self.widget.top
+
+        self.add(5)
+        self.assertEqual(self.numbers()[0], first - self.PAGE)  # Nothing trimmed
+        self.assertEqual(self.widget.top, reading)              # View not snapped to the end
+
+        # Back at the end, the next line trims the paged-in history again
+        self.widget.see('end')
+        self.add(1)
+        self.assertGreater(self.numbers()[0], first - self.PAGE)
+        self.assertEqual(self.numbers(), list(range(self.numbers()[0], self.sent)))
+
+    def test_trims_while_reading_past_twice_the_limit(self):
+        self.add(300)
+        self.widget.scroll_to_top()
+        self.add(2 * self.LIMIT)
+        self.assertLessEqual(len(self.widget.lines), 2 * self.LIMIT)
+        self.assertEqual(self.numbers(), list(range(self.numbers()[0], self.sent)))
+
+
+if __name__ == '__main__':
+    unittest.main()